@@ -7,3 +7,10 @@ CHATGPT_ROLE_PROMPTS = {
         "Be direct, use best practices, explain trade-offs."
     ),
 }
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for your own future reference. "
+    "Keep facts, decisions, user preferences, names and open questions. "
+    "If a previous summary is given, merge it in. "
+    "Answer with the summary only, no more than 300 words."
+)
@@ -1,5 +1,34 @@
+import json
 import logging
 import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+# ids of the update being handled (set by app.tracing), added to JSON logs
+log_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with trace/update ids of the current update
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **log_context.get(),
+        }
+        trace = getattr(record, "trace", None)
+        if trace is not None:
+            payload["trace"] = trace
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
 
 logger = logging.getLogger("ezBot")
 logger.setLevel(logging.INFO)
@@ -17,3 +46,11 @@ if not logger.handlers:
     logger.addHandler(handler)
 
     logger.propagate = False
+
+
+def use_json_logs() -> None:
+    """
+    Switch ezBot handlers to JsonFormatter (LOG_FORMAT=json)
+    """
+    for log_handler in logger.handlers:
+        log_handler.setFormatter(JsonFormatter())
@@ -1,7 +1,9 @@
+from app.db.chat_archive_repo import ChatArchiveRepo
 from app.db.db_init import init_db
 from app.db.user_repo import UserRepo
 
 __all__ = [
     "init_db",
     "UserRepo",
+    "ChatArchiveRepo",
 ]
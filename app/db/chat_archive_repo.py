@@ -0,0 +1,105 @@
+from typing import Sequence
+
+from psycopg_pool import AsyncConnectionPool
+
+from app.metrics import POSTGRES_LATENCY, observe
+from app.models.chat_message import ArchivedMessage
+
+# ORDER BY ordinality => ids follow the order of the batch
+INSERT_MESSAGES_SQL = """
+INSERT INTO bot.chat_messages (conversation, speaker_role, content, tokens, created_at)
+SELECT t.conversation, t.speaker_role, t.content, t.tokens, to_timestamp(t.created_at)
+FROM unnest(
+    %s::text[], %s::text[], %s::text[], %s::int[], %s::double precision[]
+) WITH ORDINALITY AS t(conversation, speaker_role, content, tokens, created_at, n)
+ORDER BY t.n;
+"""
+
+# served by the (conversation, id) primary key of one partition
+LOAD_RECENT_SQL = """
+SELECT speaker_role, content, tokens, extract(epoch FROM created_at)
+FROM bot.chat_messages
+WHERE conversation = %s
+ORDER BY id DESC
+LIMIT %s;
+"""
+
+DELETE_CONVERSATION_SQL = """
+DELETE FROM bot.chat_messages
+WHERE conversation = %s;
+"""
+
+CONVERSATIONS_SQL = """
+SELECT DISTINCT conversation
+FROM bot.chat_messages;
+"""
+
+RENAME_CONVERSATION_SQL = """
+UPDATE bot.chat_messages
+SET conversation = %s
+WHERE conversation = %s;
+"""
+
+
+class ChatArchiveRepo:
+    """
+    Cold tier of chat history: bot.chat_messages, hash-partitioned by conversation
+    Uses the connection pool of UserRepo (opened/closed by it)
+    """
+
+    def __init__(self, pool: AsyncConnectionPool) -> None:
+        self.pool = pool
+
+    async def insert_messages(self, messages: Sequence[ArchivedMessage]) -> None:
+        if not messages:
+            return
+        with observe(POSTGRES_LATENCY, query="insert_chat_messages"):
+            async with self.pool.connection() as conn:
+                await conn.execute(
+                    INSERT_MESSAGES_SQL,
+                    (
+                        [msg.conversation for msg in messages],
+                        [msg.speaker_role for msg in messages],
+                        [msg.content for msg in messages],
+                        [msg.tokens for msg in messages],
+                        [msg.created_at for msg in messages],
+                    ),
+                )
+
+    async def load_recent(self, conversation: str, limit: int) -> list[ArchivedMessage]:
+        """
+        Last `limit` messages of conversation, oldest first
+        """
+        with observe(POSTGRES_LATENCY, query="load_chat_messages"):
+            async with self.pool.connection() as conn:
+                cur = await conn.execute(
+                    LOAD_RECENT_SQL, (conversation, limit), prepare=True
+                )
+                rows = await cur.fetchall()
+        return [
+            ArchivedMessage(conversation, role, content, tokens, float(created_at))
+            for role, content, tokens, created_at in reversed(rows)
+        ]
+
+    async def delete_conversation(self, conversation: str) -> None:
+        with observe(POSTGRES_LATENCY, query="delete_chat_messages"):
+            async with self.pool.connection() as conn:
+                await conn.execute(DELETE_CONVERSATION_SQL, (conversation,))
+
+    async def rename_conversation(self, old: str, new: str) -> int:
+        """
+        Move archived messages to another conversation, returns moved rows
+        """
+        with observe(POSTGRES_LATENCY, query="rename_chat_conversation"):
+            async with self.pool.connection() as conn:
+                cur = await conn.execute(RENAME_CONVERSATION_SQL, (new, old))
+                return cur.rowcount
+
+    async def conversations(self) -> list[str]:
+        """
+        All archived conversations (full scan, for one-off migrations)
+        """
+        with observe(POSTGRES_LATENCY, query="chat_conversations"):
+            async with self.pool.connection() as conn:
+                cur = await conn.execute(CONVERSATIONS_SQL)
+                return [row[0] for row in await cur.fetchall()]
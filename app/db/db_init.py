@@ -30,6 +30,47 @@ CREATE TABLE IF NOT EXISTS bot.users (
 );
 """
 
+# cold tier of chat history, see ChatArchiveRepo
+CREATE_CHAT_MESSAGES_SQL = """
+CREATE TABLE IF NOT EXISTS bot.chat_messages (
+    conversation TEXT NOT NULL,
+    id           BIGSERIAL,
+    speaker_role TEXT NOT NULL,
+    content      TEXT NOT NULL,
+    tokens       INT NOT NULL,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (conversation, id)
+) PARTITION BY HASH (conversation);
+"""
+
+CREATE_CHAT_MESSAGES_PARTITION_SQL = """
+CREATE TABLE IF NOT EXISTS bot.{}
+PARTITION OF bot.chat_messages
+FOR VALUES WITH (MODULUS {}, REMAINDER {});
+"""
+
+CHAT_MESSAGES_PARTITIONS_SQL = """
+SELECT count(*) FROM pg_inherits WHERE inhparent = 'bot.chat_messages'::regclass;
+"""
+
+# bump together with any DDL change above => next start runs the bootstrap
+SCHEMA_VERSION = 1
+
+CREATE_SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS bot.schema_version (
+    version    INT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+"""
+
+GET_SCHEMA_VERSION_SQL = """
+SELECT max(version) FROM bot.schema_version;
+"""
+
+SET_SCHEMA_VERSION_SQL = """
+INSERT INTO bot.schema_version (version) VALUES (%s);
+"""
+
 UPSERT_ADMIN_SQL = """
 INSERT INTO bot.users (tg_id, role, username, first_name, last_name)
 VALUES (%s, 'admin', 'superadmin', 'Super', 'Admin')
@@ -110,7 +151,15 @@ def init_db() -> None:
     """
     Check connection to Postgres
     Create schema/table, insert admin-user if does not exist
+    Skipped if bot.schema_version is current (DB_BOOTSTRAP=auto) or disabled
     """
+    if settings.db_bootstrap == "never":
+        logger.info("DB init skipped (DB_BOOTSTRAP=never)")
+        return
+    if settings.db_bootstrap == "auto" and _schema_is_current():
+        logger.info("Schema version %s is current, DB init skipped", SCHEMA_VERSION)
+        return
+
     logger.info("Database init started")
     ensure_database_exists(settings.postgres_dsn)
 
@@ -130,7 +179,67 @@ def init_db() -> None:
             logger.info("Ensuring table bot.users exists")
             cur.execute(CREATE_USERS_SQL)
 
+            logger.info(
+                "Ensuring table bot.chat_messages exists (%s partitions)",
+                settings.chat_archive_partitions,
+            )
+            cur.execute(CREATE_CHAT_MESSAGES_SQL)
+            _create_chat_messages_partitions(cur)
+
             logger.info("Ensuring admin user %s exists", settings.admin_user_id)
             cur.execute(UPSERT_ADMIN_SQL, (settings.admin_user_id,))
 
+            cur.execute(CREATE_SCHEMA_VERSION_SQL)
+            cur.execute(GET_SCHEMA_VERSION_SQL)
+            row = cur.fetchone()
+            if not row or row[0] != SCHEMA_VERSION:
+                cur.execute(SET_SCHEMA_VERSION_SQL, (SCHEMA_VERSION,))
+
     logger.info("DB init completed successfully")
+
+
+def _create_chat_messages_partitions(cur: psycopg.Cursor) -> None:
+    """
+    Partition count is fixed once the table is created: new partitions
+    with another modulus would overlap the existing ones
+    """
+    cur.execute(CHAT_MESSAGES_PARTITIONS_SQL)
+    row = cur.fetchone()
+    existing = row[0] if row else 0
+    if existing:
+        if existing != settings.chat_archive_partitions:
+            logger.warning(
+                "bot.chat_messages has %s partitions, CHAT_ARCHIVE_PARTITIONS=%s "
+                "is ignored",
+                existing,
+                settings.chat_archive_partitions,
+            )
+        return
+    for remainder in range(settings.chat_archive_partitions):
+        cur.execute(
+            psycopg.sql.SQL(CREATE_CHAT_MESSAGES_PARTITION_SQL).format(
+                psycopg.sql.Identifier(f"chat_messages_p{remainder}"),
+                psycopg.sql.Literal(settings.chat_archive_partitions),
+                psycopg.sql.Literal(remainder),
+            )
+        )
+
+
+def _schema_is_current() -> bool:
+    """
+    One connection to the bot DB: if bot.schema_version is current,
+    only the admin user is upserted (ADMIN_USER_ID may have changed)
+    """
+    try:
+        with psycopg.connect(settings.postgres_dsn, autocommit=True) as conn:
+            with conn.cursor() as cur:
+                cur.execute(GET_SCHEMA_VERSION_SQL)
+                row = cur.fetchone()
+                if not row or row[0] != SCHEMA_VERSION:
+                    return False
+                cur.execute(UPSERT_ADMIN_SQL, (settings.admin_user_id,))
+                return True
+    except psycopg.Error as exc:
+        # no DB / no marker table yet => full bootstrap reports real errors
+        logger.info("Schema version check failed, running DB init: %s", exc)
+        return False
@@ -1,10 +1,12 @@
-from contextlib import contextmanager
-from typing import Iterator, Optional, cast
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Optional, Sequence, cast
 
-import psycopg
-from psycopg import Connection, Cursor
+from psycopg import AsyncCursor
+from psycopg_pool import AsyncConnectionPool
 
 from app.config import settings
+from app.metrics import POSTGRES_LATENCY, POSTGRES_POOL, observe
 from app.models.telegram_user import TelegramUserData
 
 GET_ROLE_SQL = """
@@ -38,23 +40,97 @@ SET
 RETURNING role;
 """
 
+# multi-row variant of UPSERT_USER_SQL for write-behind batches, keeps role as is
+UPSERT_SEEN_USERS_SQL = """
+INSERT INTO bot.users (tg_id, role, username, first_name, last_name, last_seen_at)
+SELECT t.tg_id, %s, t.username, t.first_name, t.last_name, to_timestamp(t.seen_at)
+FROM unnest(
+    %s::bigint[], %s::text[], %s::text[], %s::text[], %s::double precision[]
+) AS t(tg_id, username, first_name, last_name, seen_at)
+ON CONFLICT (tg_id) DO UPDATE
+SET
+    username = EXCLUDED.username,
+    first_name = EXCLUDED.first_name,
+    last_name = EXCLUDED.last_name,
+    last_seen_at = GREATEST(bot.users.last_seen_at, EXCLUDED.last_seen_at),
+    is_active = TRUE;
+"""
+
+RoleListener = Callable[[int], Awaitable[None]]
+
+# POSTGRES_POOL state label => psycopg_pool stats key
+_POOL_GAUGES = {
+    "size": "pool_size",
+    "available": "pool_available",
+    "waiting": "requests_waiting",
+}
+
+
+# latest seen user wins if a username was reused
+USERNAMES_SQL = """
+SELECT username, tg_id
+FROM bot.users
+WHERE username IS NOT NULL
+ORDER BY last_seen_at;
+"""
+
 
 class UserRepo:
-    conn: Connection
+    pool: AsyncConnectionPool
+
+    def __init__(self) -> None:
+        # connections are opened in connect(), inside the bot event loop
+        self.pool = AsyncConnectionPool(
+            settings.postgres_dsn,
+            min_size=settings.pg_pool_min_size,
+            max_size=settings.pg_pool_max_size,
+            timeout=settings.pg_pool_timeout,
+            kwargs={"autocommit": True},
+            check=AsyncConnectionPool.check_connection,
+            name="user_repo",
+            open=False,
+        )
+        self._role_listeners: list[RoleListener] = []
+        for state, key in _POOL_GAUGES.items():
+            POSTGRES_POOL.labels(state=state).set_function(
+                partial(self._pool_stat, key)
+            )
+
+    def add_role_listener(self, listener: RoleListener) -> None:
+        """
+        Subscribe to role changes made by set_role (e.g. to invalidate caches)
+        """
+        self._role_listeners.append(listener)
 
-    def __init__(self):
-        self.conn: Connection = psycopg.connect(settings.postgres_dsn, autocommit=True)
+    async def connect(self) -> None:
+        """
+        Open Postgres connection pool and wait for min_size connections
+        Must be awaited inside the bot event loop before handlers are called
+        """
+        await self.pool.open(wait=True, timeout=settings.pg_pool_timeout)
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    def pool_stats(self) -> dict[str, int]:
+        """
+        Pool counters (pool_size, pool_available, requests_waiting, ...)
+        """
+        return self.pool.get_stats()
+
+    def _pool_stat(self, key: str) -> int:
+        return self.pool_stats().get(key, 0)
 
-    @contextmanager
-    def _cursor(self) -> Iterator[Cursor]:
-        conn = cast(Connection, self.conn)
-        cur = conn.cursor()  # pylint: disable=no-member
-        try:
-            yield cast(Cursor, cur)
-        finally:
-            cur.close()
+    @asynccontextmanager
+    async def _cursor(self, query: str) -> AsyncIterator[AsyncCursor]:
+        # checked out connection is health-checked by the pool and
+        # replaced transparently if Postgres was restarted
+        with observe(POSTGRES_LATENCY, query=query):
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    yield cur
 
-    def upsert_and_get_role(
+    async def upsert_and_get_role(
         self,
         user: TelegramUserData,
         default_role: str = "guest",
@@ -64,8 +140,8 @@ class UserRepo:
         If user new - we grant him default_role
         Admin is seeded by init_db() and will keep 'admin' role
         """
-        with self._cursor() as cur:
-            cur.execute(
+        async with self._cursor("upsert_and_get_role") as cur:
+            await cur.execute(
                 UPSERT_USER_SQL,
                 (
                     user.tg_id,
@@ -74,23 +150,58 @@ class UserRepo:
                     user.first_name,
                     user.last_name,
                 ),
+                prepare=True,
             )
-            row = cur.fetchone()
+            row = await cur.fetchone()
             return cast(str, row[0] if row else default_role)
 
-    def set_role(self, tg_id: int, role: str) -> None:
+    async def upsert_seen_users(
+        self,
+        users: Sequence[tuple[TelegramUserData, float]],
+        default_role: str = "guest",
+    ) -> None:
+        """
+        Save profile fields and last_seen_at (unix time) of many users
+        in one statement. New users get default_role
+        """
+        if not users:
+            return
+        async with self._cursor("upsert_seen_users") as cur:
+            await cur.execute(
+                UPSERT_SEEN_USERS_SQL,
+                (
+                    default_role,
+                    [user.tg_id for user, _ in users],
+                    [user.username for user, _ in users],
+                    [user.first_name for user, _ in users],
+                    [user.last_name for user, _ in users],
+                    [seen_at for _, seen_at in users],
+                ),
+            )
+
+    async def set_role(self, tg_id: int, role: str) -> None:
         """
         Forcibly set a user's role (e.g. admin promotes someone to 'user').
         Creates the user if missing.
         """
-        with self._cursor() as cur:
-            cur.execute(
+        async with self._cursor("set_role") as cur:
+            await cur.execute(
                 SET_ROLE_SQL,
                 (tg_id, role),
             )
+        for listener in self._role_listeners:
+            await listener(tg_id)
 
-    def get_role(self, tg_id: int) -> Optional[str]:
-        with self._cursor() as cur:
-            cur.execute(GET_ROLE_SQL, (tg_id,))
-            row = cur.fetchone()
+    async def get_role(self, tg_id: int) -> Optional[str]:
+        async with self._cursor("get_role") as cur:
+            await cur.execute(GET_ROLE_SQL, (tg_id,), prepare=True)
+            row = await cur.fetchone()
             return cast(Optional[str], row[0] if row else None)
+
+    async def tg_ids_by_username(self) -> dict[str, int]:
+        """
+        username -> tg_id of all known users (history key migration)
+        """
+        async with self._cursor("tg_ids_by_username") as cur:
+            await cur.execute(USERNAMES_SQL)
+            return dict(await cur.fetchall())
@@ -13,10 +13,11 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     user_cache = context.application.bot_data["user_cache"]
     user_repo = context.application.bot_data["user_repo"]
+    role_cache = context.application.bot_data["role_cache"]
 
     telegram_user = user_cache.get_or_create(update)
 
-    user_role = user_repo.get_role(telegram_user.tg_id)
+    user_role = await role_cache.resolve(telegram_user)
     if user_role != "admin":
         await update.message.reply_text("⛔ You have no access to /add in this bot.")
         logger.info(
@@ -46,7 +47,8 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    user_repo.set_role(target_tg_id, "user")
+    # UserRepo notifies role_cache, so target gets the new role on next message
+    await user_repo.set_role(target_tg_id, "user")
 
     await update.message.reply_text(
         f"✅ User with telegram_id={target_tg_id} has now role 'user'."
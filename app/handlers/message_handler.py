@@ -1,9 +1,120 @@
+from functools import partial
+from typing import Callable
+
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from app.config import logger, settings
+from app.models.telegram_user import TelegramUserData
 from app.services import history_service, user_role_allowed
-from app.services.gpt_service import ask_gpt
+from app.services.gpt_scheduler import (
+    PRIORITY_ADMIN,
+    PRIORITY_USER,
+    SchedulerBusyError,
+)
+from app.services.stream_reply import stream_answer
+from app.services.update_processor import defer_update
+
+
+async def _get_answer(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    chatgpt_role: str,
+    user_text_and_context: list[dict[str, str]],
+    priority: int,
+    mark_replying: Callable[[], None],
+) -> tuple[str, bool]:
+    """
+    Get answer from response cache or OpenAI
+    Returns answer and flag whether it was already streamed to user
+    """
+    ask_gpt = context.application.bot_data["ask_gpt"]
+    stream_gpt = context.application.bot_data["stream_gpt"]
+    response_cache = context.application.bot_data["response_cache"]
+    sender = context.application.bot_data["telegram_sender"]
+
+    # repeated prompt => answer from cache, no OpenAI call
+    answer = await response_cache.get(chatgpt_role, user_text_and_context)
+    if answer is not None:
+        return answer, False
+
+    # call OpenAI model
+    if settings.gpt_stream:
+        # user sees the answer growing, history gets it once the stream is over
+        assert update.message is not None  # MessageHandler(filters.TEXT)
+        mark_replying()
+        answer = await stream_answer(
+            update.message,
+            stream_gpt(user_text_and_context, priority=priority),
+            sender,
+        )
+    else:
+        answer = await ask_gpt(user_text_and_context, priority=priority)
+
+    await response_cache.put(chatgpt_role, user_text_and_context, answer)
+    return answer, settings.gpt_stream
+
+
+async def _answer_turn(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    telegram_user: TelegramUserData,
+    user_text: str,
+    mark_saved: Callable[[], None],
+    mark_replying: Callable[[], None],
+) -> None:
+    """
+    One user turn: save user text, get answer, save it and send it back
+    """
+    role_cache = context.application.bot_data["role_cache"]
+    sender = context.application.bot_data["telegram_sender"]
+    thread_id = 0
+    chatgpt_role = "default"
+
+    # admins skip the OpenAI queue (role is already cached by auth check)
+    role = await role_cache.resolve(telegram_user)
+    priority = PRIORITY_ADMIN if role == "admin" else PRIORITY_USER
+
+    # add user input to chat history and get chat history + user input back
+    user_text_and_context = await history_service.append_and_get_recent(
+        telegram_user.tg_id,
+        chatgpt_role,
+        thread_id,
+        "user",  # speaker_role
+        user_text,
+    )
+    mark_saved()
+
+    try:
+        answer, streamed = await _get_answer(
+            update,
+            context,
+            chatgpt_role,
+            user_text_and_context,
+            priority,
+            mark_replying,
+        )
+    except SchedulerBusyError:
+        await update.message.reply_text(
+            "⏳ Слишком много запросов, попробуйте через минуту."
+        )
+        return
+    mark_replying()
+
+    # add OpenAI answer to chat history
+    await history_service.append_message(
+        telegram_user.tg_id,
+        chatgpt_role,
+        thread_id,
+        "assistant",  # speaker_role
+        answer,
+    )
+
+    if streamed:
+        return
+
+    # send user response back (rate limited, split by paragraphs/code blocks)
+    await sender.send_answer(update.message, answer)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -11,52 +122,39 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     forward default message to GPT and return response
     """
     user_cache = context.application.bot_data["user_cache"]
-    user_repo = context.application.bot_data["user_repo"]
+    role_cache = context.application.bot_data["role_cache"]
+    coalescer = context.application.bot_data.get("message_coalescer")
 
     telegram_user = user_cache.get_or_create(update)
-    if not user_role_allowed(telegram_user, user_repo):
+    if not await user_role_allowed(telegram_user, role_cache):
         await update.message.reply_text(
             "⛔ You have no access to message ChatGPT in this bot."
         )
-        return
+        return None
 
     user_text = update.message.text
     logger.info("Got message from user %s", telegram_user.username)
-    thread_id = 0
 
     if not user_text or user_text.strip() == "":
         await update.message.reply_text(
             "Мне нужен текст запроса. Не могу отправить пустой"
         )
-        return
-
-    # add user input to chat history
-    history_service.append_message(
-        telegram_user.username,
-        "default",  # chatgpt_role
-        thread_id,
-        "user",  # speaker_role
-        user_text,
-    )
+        return None
 
-    # get chat history + user input
-    user_text_and_context = history_service.get_recent_history(
-        telegram_user.username, chatgpt_role="default", thread_id=0
-    )
-
-    # call OpenAI model
-    answer = ask_gpt(user_text_and_context)
+    if coalescer is None:
+        await _answer_turn(
+            update, context, telegram_user, user_text, lambda: None, lambda: None
+        )
+        return None
 
-    # add OpenAI answer to chat history
-    history_service.append_message(
-        telegram_user.username,
-        "default",  # chatgpt_role
-        thread_id,
-        "assistant",  # speaker_role
-        answer,
+    # message may be one part of a long paste => merge rapid fragments
+    # into one turn, answer runs in background so next fragment can arrive
+    answered = coalescer.submit(
+        context.application,
+        update,
+        user_text,
+        partial(_answer_turn, update, context, telegram_user),
     )
-
-    # send user response back
-    for i in range(0, len(answer), settings.telegram_msg_max_len):
-        chunk = answer[i : i + settings.telegram_msg_max_len]
-        await update.message.reply_text(chunk)
+    # the update is handled once the turn answered it (returned to wrappers)
+    defer_update(answered)
+    return answered
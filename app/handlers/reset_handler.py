@@ -7,34 +7,43 @@ from app.services import history_service, user_role_allowed
 
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    /reset handler
+    /reset handler, "/reset all" deletes history of every role and thread
     """
     user_cache = context.application.bot_data["user_cache"]
-    user_repo = context.application.bot_data["user_repo"]
+    role_cache = context.application.bot_data["role_cache"]
 
     telegram_user = user_cache.get_or_create(update)
 
     thread_id = 0
     chatgpt_role = "default"
 
-    if not user_role_allowed(telegram_user, user_repo):
+    if not await user_role_allowed(telegram_user, role_cache):
         await update.message.reply_text("⛔ You have no access to /reset in this bot.")
         logger.info(
             "User %s was restricted from using /reset command.", telegram_user.username
         )
         return
 
-    history_service.reset_history(
-        username=telegram_user.username,
-        chatgpt_role=chatgpt_role,
-        thread_id=0,
-    )
-
-    reply_text = (
-        "Your chat history has been deleted.\n\n"
-        f"User = {telegram_user.username}\n"
-        f"ChatGPT role = {chatgpt_role}\n"
-        f"Thread_id = {thread_id}\n"
-    )
+    coalescer = context.application.bot_data.get("message_coalescer")
+    if coalescer is not None and update.effective_chat is not None:
+        coalescer.cancel(update.effective_chat.id)
+
+    if context.args and context.args[0].lower() == "all":
+        threads = await history_service.reset_all_history(telegram_user.tg_id)
+        reply_text = (
+            f"Your chat history has been deleted.\n\nThreads deleted = {threads}\n"
+        )
+    else:
+        await history_service.reset_history(
+            tg_id=telegram_user.tg_id,
+            chatgpt_role=chatgpt_role,
+            thread_id=0,
+        )
+        reply_text = (
+            "Your chat history has been deleted.\n\n"
+            f"User = {telegram_user.username}\n"
+            f"ChatGPT role = {chatgpt_role}\n"
+            f"Thread_id = {thread_id}\n"
+        )
 
     await update.message.reply_text(reply_text)
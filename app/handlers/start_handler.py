@@ -12,8 +12,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_cache = context.application.bot_data["user_cache"]
     telegram_user = user_cache.get_or_create(update)
 
-    user_repo = context.application.bot_data["user_repo"]
-    role = user_repo.upsert_and_get_role(telegram_user)
+    role_cache = context.application.bot_data["role_cache"]
+    role = await role_cache.resolve(telegram_user)
 
     reply_text = (
         "Hello, I'm ezBot!\n\n"
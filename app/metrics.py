@@ -0,0 +1,173 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Coroutine, Iterator
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from app.config import logger, settings
+from app.tracing import span
+
+HandlerCallback = Callable[
+    [Update, ContextTypes.DEFAULT_TYPE], Coroutine[Any, Any, Any]
+]
+
+# storage calls are expected in milliseconds, OpenAI in seconds
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_latency_seconds",
+    "Time spent in a Telegram update handler",
+    ["handler"],
+    buckets=SLOW_BUCKETS,
+)
+OPENAI_LATENCY = Histogram(
+    "bot_openai_latency_seconds",
+    "Time spent awaiting OpenAI chat completions, from the request leaving "
+    "the gpt_scheduler queue to the last token (stream consumer excluded)",
+    ["model", "mode"],
+    buckets=SLOW_BUCKETS,
+)
+OPENAI_TOKENS = Counter(
+    "bot_openai_tokens_total",
+    "Tokens reported by OpenAI usage",
+    ["model", "kind"],
+)
+OPENAI_ERRORS = Counter(
+    "bot_openai_errors_total",
+    "Failed OpenAI chat completions",
+    ["model", "error"],
+)
+OPENAI_QUEUE_DEPTH = Gauge(
+    "bot_openai_queue_depth", "OpenAI requests waiting for a gpt_scheduler slot"
+)
+OPENAI_QUEUE_WAIT = Histogram(
+    "bot_openai_queue_wait_seconds",
+    "Time from gpt_scheduler enqueue to the granted slot",
+    ["priority"],
+    buckets=(0.01, 0.05) + SLOW_BUCKETS,
+)
+OPENAI_SCHEDULER_EVENTS = Counter(
+    "bot_openai_scheduler_events_total",
+    "gpt_scheduler rejections (queue full) and 429 retries",
+    ["event"],
+)
+OPENAI_HEDGES = Counter(
+    "bot_openai_hedges_total",
+    "Late OpenAI requests by hedge outcome (won = the hedge answered first, "
+    "lost = the original one did, capped = not sent, OPENAI_HEDGE_MAX_RATE)",
+    ["mode", "outcome"],
+)
+REDIS_LATENCY = Histogram(
+    "bot_redis_latency_seconds",
+    "Latency of Redis calls made by chat history",
+    ["op"],
+    buckets=FAST_BUCKETS,
+)
+POSTGRES_LATENCY = Histogram(
+    "bot_postgres_latency_seconds",
+    "Latency of UserRepo queries, including waiting for a pool connection",
+    ["query"],
+    buckets=FAST_BUCKETS,
+)
+POSTGRES_POOL = Gauge(
+    "bot_postgres_pool_connections",
+    "UserRepo pool connections (size, available) and requests waiting for one",
+    ["state"],
+)
+USER_WRITE_BEHIND_PENDING = Gauge(
+    "bot_user_write_behind_pending", "Users waiting for the next write-behind flush"
+)
+CHAT_ARCHIVE_PENDING = Gauge(
+    "bot_chat_archive_pending", "Chat turns waiting for the next archive flush"
+)
+USER_CACHE_SIZE = Gauge("bot_user_cache_size", "Users kept in UserCache")
+USER_CACHE_LOOKUPS = Counter(
+    "bot_user_cache_lookups_total",
+    "UserCache lookups, hit rate = hit / (hit + miss)",
+    ["result"],
+)
+USER_CACHE_EVICTIONS = Counter(
+    "bot_user_cache_evictions_total",
+    "Users dropped from UserCache (lru = size limit, ttl = idle)",
+    ["reason"],
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "bot_response_cache_lookups_total",
+    "ResponseCache lookups of cached roles (memory_hit, redis_hit, miss)",
+    ["result"],
+)
+UPDATE_DEDUP = Counter(
+    "bot_update_dedup_total",
+    "Updates by idempotency outcome (processed, in_flight, replayed)",
+    ["result"],
+)
+
+_SPAN_PREFIXES = {
+    HANDLER_LATENCY: "handler",
+    OPENAI_LATENCY: "openai",
+    REDIS_LATENCY: "redis",
+    POSTGRES_LATENCY: "postgres",
+}
+
+
+@contextmanager
+def observe(histogram: Histogram, **labels: str) -> Iterator[None]:
+    """
+    Record duration of the with-block into histogram, also on exceptions
+    The block is also a tracing span, e.g. "redis.append"
+    """
+    name = f"{_SPAN_PREFIXES.get(histogram, 'stage')}.{list(labels.values())[-1]}"
+    started = time.perf_counter()
+    try:
+        with span(name, **labels):
+            yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - started)
+
+
+def timed_handler(callback: HandlerCallback) -> HandlerCallback:
+    """
+    Wrap handler callback to record its latency under its function name
+    A handler that returns a future (answer deferred to background, e.g.
+    MessageCoalescer) is timed until that future is done
+    """
+    name = callback.__name__
+
+    def record(started: float) -> None:
+        HANDLER_LATENCY.labels(handler=name).observe(time.perf_counter() - started)
+
+    @wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        started = time.perf_counter()
+        try:
+            with span(f"handler.{name}", handler=name):
+                result = await callback(update, context)
+        except BaseException:
+            record(started)
+            raise
+        if isinstance(result, asyncio.Future):
+            result.add_done_callback(lambda _: record(started))
+        else:
+            record(started)
+        return result
+
+    return wrapper
+
+
+async def start_metrics_server() -> None:
+    """
+    Serve /metrics on METRICS_PORT (in a background thread), 0 disables
+    """
+    if settings.metrics_port <= 0:
+        return
+    start_http_server(settings.metrics_port, addr=settings.metrics_listen)
+    logger.info(
+        "Prometheus metrics on %s:%s/metrics",
+        settings.metrics_listen,
+        settings.metrics_port,
+    )
@@ -0,0 +1,10 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
+class ArchivedMessage:
+    conversation: str
+    speaker_role: str
+    content: str
+    tokens: int
+    created_at: float  # unix time
@@ -1,19 +1,45 @@
 from app.services.auth import user_role_allowed
-from app.services.gpt_service import ask_gpt
+from app.services.chat_archive import ChatArchive
+from app.services.gpt_service import ask_gpt, stream_gpt
 from app.services.history_service import (
+    append_and_get_recent,
     append_message,
     get_recent_history,
+    list_threads,
+    reset_all_history,
     reset_history,
 )
+from app.services.message_coalescer import MessageCoalescer
+from app.services.redis_client import close_redis
+from app.services.response_cache import ResponseCache
+from app.services.role_cache import RoleCache
 from app.services.telegram_app import TelegramApp
+from app.services.telegram_sender import TelegramSender
+from app.services.update_dedup import UpdateDedup
+from app.services.update_stream import UpdateStreamPublisher, UpdateStreamWorker
 from app.services.user_cache import UserCache
+from app.services.user_writer import UserWriteBehind
 
 __all__ = [
     "ask_gpt",
+    "stream_gpt",
     "user_role_allowed",
     "UserCache",
+    "RoleCache",
+    "ResponseCache",
+    "MessageCoalescer",
+    "UserWriteBehind",
+    "ChatArchive",
     "append_message",
+    "append_and_get_recent",
     "get_recent_history",
     "reset_history",
+    "reset_all_history",
+    "list_threads",
+    "close_redis",
     "TelegramApp",
+    "TelegramSender",
+    "UpdateDedup",
+    "UpdateStreamPublisher",
+    "UpdateStreamWorker",
 ]
@@ -1,11 +1,13 @@
 from app.config import logger, settings
-from app.db import UserRepo
 from app.models.telegram_user import TelegramUserData
+from app.services.role_cache import RoleCache
+from app.tracing import span
 
 
-def user_role_allowed(telegram_user: TelegramUserData, user_repo: UserRepo) -> bool:
-    role = user_repo.upsert_and_get_role(
-        telegram_user,
-    )
+async def user_role_allowed(
+    telegram_user: TelegramUserData, role_cache: RoleCache
+) -> bool:
+    with span("auth.resolve_role"):
+        role = await role_cache.resolve(telegram_user)
     logger.info("User %s have %s role", telegram_user.username, role)
     return role in settings.allowed_roles
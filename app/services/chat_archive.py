@@ -0,0 +1,119 @@
+import asyncio
+import time
+from typing import List, Optional
+
+from app.config import logger
+from app.db import ChatArchiveRepo
+from app.metrics import CHAT_ARCHIVE_PENDING
+from app.models.chat_message import ArchivedMessage
+
+
+def _same_turn(left: ArchivedMessage, right: ArchivedMessage) -> bool:
+    # created_at goes through timestamptz => compare with microsecond tolerance
+    return (
+        left.speaker_role == right.speaker_role
+        and left.content == right.content
+        and abs(left.created_at - right.created_at) < 0.001
+    )
+
+
+class ChatArchive:
+    """
+    Write-behind archive of chat history turns to Postgres
+
+    Turns are buffered in memory and inserted in one batch every interval.
+    Reads merge the archived rows with turns that are still buffered
+    """
+
+    def __init__(self, repo: ChatArchiveRepo, interval_seconds: float) -> None:
+        self._repo = repo
+        self._interval = interval_seconds
+        self._pending: List[ArchivedMessage] = []
+        # batch being inserted right now, still visible to readers
+        self._flushing: List[ArchivedMessage] = []
+        # forget() must not run while a batch with its turns is being inserted
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        CHAT_ARCHIVE_PENDING.set_function(lambda: self.pending_count)
+
+    def record(
+        self, conversation: str, speaker_role: str, content: str, tokens: int
+    ) -> None:
+        self._pending.append(
+            ArchivedMessage(conversation, speaker_role, content, tokens, time.time())
+        )
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def load_recent(self, conversation: str, limit: int) -> List[ArchivedMessage]:
+        """
+        Last `limit` turns of conversation (oldest first), buffered ones included
+        """
+        pending = [
+            msg
+            for msg in self._flushing + self._pending
+            if msg.conversation == conversation
+        ]
+        archived = await self._repo.load_recent(conversation, limit)
+        # a batch may have been flushed while we were reading
+        archived = [
+            msg
+            for msg in archived
+            if not any(_same_turn(msg, buffered) for buffered in pending)
+        ]
+        return (archived + pending)[-limit:]
+
+    async def forget(self, conversation: str) -> None:
+        """
+        Drop archived and buffered turns of conversation (/reset)
+        """
+        async with self._lock:
+            self._pending = [
+                msg for msg in self._pending if msg.conversation != conversation
+            ]
+            await self._repo.delete_conversation(conversation)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """
+        Stop background flushing and archive everything that is still pending
+        """
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, []
+            self._flushing = batch
+            try:
+                await self._repo.insert_messages(batch)
+            except Exception:
+                # keep order: failed batch goes before turns recorded meanwhile
+                self._pending = batch + self._pending
+                raise
+            finally:
+                self._flushing = []
+        logger.debug("Archived %s chat turns", len(batch))
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            if not self._pending:
+                continue
+            try:
+                await self.flush()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to archive chat turns: %s", exc)
@@ -0,0 +1,155 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import suppress
+from typing import Awaitable, Callable, Deque, Optional, TypeVar
+
+from app.config import logger, settings
+from app.metrics import OPENAI_HEDGES
+
+T = TypeVar("T")
+
+# recent calls used for the p95 and for the hedge rate cap
+HEDGE_WINDOW = 200
+# no hedging on the rolling p95 before this many samples
+HEDGE_MIN_SAMPLES = 20
+
+# request(mark_sent) awaits its gpt_scheduler slot, calls mark_sent() right
+# before the HTTP request and returns once the first token is there
+HedgedRequest = Callable[[Callable[[], None]], Awaitable[T]]
+
+
+class Hedger:
+    """
+    Hedged OpenAI requests (OPENAI_HEDGE)
+
+    If the first token (whole answer for ask_gpt) takes longer than
+    OPENAI_HEDGE_AFTER or the rolling p95, an identical request is sent
+    and whichever answers first wins, the other one is cancelled.
+    At most OPENAI_HEDGE_MAX_RATE of recent calls are hedged
+    """
+
+    def __init__(self, mode: str) -> None:
+        self._mode = mode
+        self._first_token: Deque[float] = deque(maxlen=HEDGE_WINDOW)
+        self._hedged: Deque[bool] = deque(maxlen=HEDGE_WINDOW)
+
+    def hedge_after(self) -> Optional[float]:
+        if not settings.openai_hedge:
+            return None
+        if settings.openai_hedge_after > 0:
+            return settings.openai_hedge_after
+        if len(self._first_token) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._first_token)
+        return ordered[int(len(ordered) * 0.95)]
+
+    def _may_hedge(self) -> bool:
+        allowed = settings.openai_hedge_max_rate * (len(self._hedged) + 1)
+        return sum(self._hedged) + 1 <= allowed
+
+    async def _attempt(self, request: HedgedRequest[T], sent: asyncio.Event) -> T:
+        sent_at = 0.0
+
+        def mark_sent() -> None:
+            nonlocal sent_at
+            sent_at = time.monotonic()
+            sent.set()
+
+        try:
+            result = await request(mark_sent)
+        except asyncio.CancelledError:
+            if sent.is_set():
+                # lost the race: at least this long, keeping it out of the
+                # window would bias the p95 towards the fast attempts
+                self._first_token.append(time.monotonic() - sent_at)
+            raise
+        self._first_token.append(time.monotonic() - sent_at)
+        return result
+
+    async def run(
+        self, request: HedgedRequest[T], discard: Callable[[T], Awaitable[None]]
+    ) -> T:
+        """
+        Result of request(), hedged if it is late
+        discard() releases a result that lost the race (e.g. closes a stream)
+        """
+        hedge_after = self.hedge_after()
+        sent = asyncio.Event()
+        if hedge_after is None:
+            self._hedged.append(False)
+            return await self._attempt(request, sent)
+        primary = asyncio.create_task(self._attempt(request, sent))
+
+        try:
+            # the timer starts once the request has left the scheduler queue
+            sent_wait = asyncio.create_task(sent.wait())
+            try:
+                await asyncio.wait(
+                    {primary, sent_wait}, return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                sent_wait.cancel()
+            if not primary.done():
+                await asyncio.wait({primary}, timeout=hedge_after)
+            if primary.done():
+                self._hedged.append(False)
+                return primary.result()
+            if not self._may_hedge():
+                self._hedged.append(False)
+                OPENAI_HEDGES.labels(mode=self._mode, outcome="capped").inc()
+                return await primary
+        except BaseException:
+            await _cancel(primary, discard)
+            raise
+
+        self._hedged.append(True)
+        logger.info(
+            "OpenAI %s is late (>%.1fs), sending a hedge", self._mode, hedge_after
+        )
+        hedge = asyncio.create_task(self._attempt(request, asyncio.Event()))
+        winner = await _first_success(primary, hedge, discard)
+        result = winner.result()
+        outcome = "won" if winner is hedge else "lost"
+        OPENAI_HEDGES.labels(mode=self._mode, outcome=outcome).inc()
+        return result
+
+
+async def _cancel(
+    task: "asyncio.Task[T]", discard: Callable[[T], Awaitable[None]]
+) -> None:
+    task.cancel()
+    with suppress(BaseException):
+        result = await task
+        # finished before it could be cancelled
+        await discard(result)
+
+
+async def _first_success(
+    first: "asyncio.Task[T]",
+    second: "asyncio.Task[T]",
+    discard: Callable[[T], Awaitable[None]],
+) -> "asyncio.Task[T]":
+    """
+    Task that succeeded first, the other one is cancelled
+    If both fail, the one that failed last
+    """
+    pending = {first, second}
+    try:
+        while True:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            succeeded = [
+                task
+                for task in (first, second)
+                if task in done and not task.exception()
+            ]
+            if succeeded or not pending:
+                for task in succeeded[1:]:
+                    # both answered at once
+                    await discard(task.result())
+                return succeeded[0] if succeeded else done.pop()
+    finally:
+        for task in pending:
+            await _cancel(task, discard)
@@ -0,0 +1,186 @@
+# pylint: disable=too-many-instance-attributes
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, TypeVar
+
+from app.config import logger, settings
+from app.metrics import OPENAI_QUEUE_DEPTH, OPENAI_QUEUE_WAIT, OPENAI_SCHEDULER_EVENTS
+from app.services.rate_limit import TokenBucket
+
+if TYPE_CHECKING:
+    import openai
+
+T = TypeVar("T")
+
+PRIORITY_ADMIN = 0
+PRIORITY_USER = 1
+PRIORITY_BACKGROUND = 2  # e.g. history compaction
+
+
+class SchedulerBusyError(RuntimeError):
+    """
+    OpenAI request queue is full, caller should ask user to retry later
+    """
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class GptScheduler:
+    """
+    Global gate in front of OpenAI calls
+
+    - token buckets for requests per minute and (estimated) tokens per minute
+    - priority queue: lower priority value goes first, FIFO inside one priority
+    - bounded queue: SchedulerBusyError instead of waiting forever,
+      only live waiters count (cancelled ones are skipped lazily)
+    - 429 => retry with jittered exponential backoff honoring Retry-After,
+      all dispatching is paused for that time
+    """
+
+    def __init__(self, rpm: int, tpm: int, max_queue: int, max_retries: int) -> None:
+        self._requests = TokenBucket(rpm / 60, rpm) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm / 60, tpm) if tpm > 0 else None
+        self._max_queue = max_queue
+        self._max_retries = max_retries
+        self._queue: list[_Waiter] = []
+        # waiters in _queue that are not granted or cancelled yet
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        OPENAI_QUEUE_DEPTH.set_function(lambda: self._waiting)
+
+    async def run(
+        self, call: Callable[[], Awaitable[T]], priority: int, tokens: int
+    ) -> T:
+        """
+        Wait for a slot and await call(), retry on OpenAI rate limit errors
+        """
+        # openai is imported lazily by gpt_service, this one is a dict lookup
+        import openai  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+        attempt = 0
+        while True:
+            await self.acquire(priority, tokens)
+            try:
+                return await call()
+            except openai.RateLimitError as exc:
+                if attempt >= self._max_retries:
+                    raise
+                delay = self._retry_delay(exc, attempt)
+                attempt += 1
+                OPENAI_SCHEDULER_EVENTS.labels(event="retry").inc()
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning(
+                    "OpenAI rate limit hit, retry %s/%s in %.1fs",
+                    attempt,
+                    self._max_retries,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+
+    async def acquire(self, priority: int, tokens: int) -> None:
+        if self._waiting >= self._max_queue:
+            OPENAI_SCHEDULER_EVENTS.labels(event="rejected").inc()
+            raise SchedulerBusyError("OpenAI request queue is full")
+
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        enqueued_at = time.monotonic()
+        waiter = _Waiter(
+            priority=priority,
+            seq=next(self._seq),
+            tokens=tokens,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        heapq.heappush(self._queue, waiter)
+        self._waiting += 1
+        self._wakeup.set()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # granted right before the cancel => already counted by _dispatch
+            if waiter.future.cancel() or waiter.future.cancelled():
+                self._waiting -= 1
+                self._drop_cancelled()
+            raise
+
+        OPENAI_QUEUE_WAIT.labels(priority=str(priority)).observe(
+            time.monotonic() - enqueued_at
+        )
+
+    def _drop_cancelled(self) -> None:
+        # cancelled waiters deep in the heap would otherwise pile up there
+        if len(self._queue) > 2 * self._waiting + 16:
+            self._queue = [w for w in self._queue if not w.future.done()]
+            heapq.heapify(self._queue)
+
+    async def _dispatch(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            # cancelled callers leave done futures behind
+            while self._queue and self._queue[0].future.done():
+                heapq.heappop(self._queue)
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            head = self._queue[0]
+            delay = max(
+                self._paused_until - time.monotonic(),
+                self._requests.time_until(1) if self._requests else 0.0,
+                self._tokens.time_until(head.tokens) if self._tokens else 0.0,
+            )
+            if delay > 0:
+                # a higher priority waiter may arrive meanwhile => re-check head
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._queue)
+            if self._requests:
+                self._requests.consume(1)
+            if self._tokens:
+                self._tokens.consume(head.tokens)
+            self._waiting -= 1
+            head.future.set_result(None)
+
+    @staticmethod
+    def _retry_delay(exc: "openai.RateLimitError", attempt: int) -> float:
+        headers = exc.response.headers
+        try:
+            if "retry-after-ms" in headers:
+                return float(headers["retry-after-ms"]) / 1000
+            if "retry-after" in headers:
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+        # full jitter: 0.5, 1, 2, 4 ... seconds on average
+        return random.uniform(0, 2**attempt)
+
+
+gpt_scheduler = GptScheduler(
+    rpm=settings.openai_rpm,
+    tpm=settings.openai_tpm,
+    max_queue=settings.openai_queue_max,
+    max_retries=settings.openai_max_retries,
+)
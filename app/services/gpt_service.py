@@ -1,21 +1,234 @@
-from openai import OpenAI
+import asyncio
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Optional, Tuple, cast
 
 from app.config import settings
+from app.metrics import OPENAI_ERRORS, OPENAI_LATENCY, OPENAI_TOKENS
+from app.services.gpt_hedge import Hedger
+from app.services.gpt_scheduler import PRIORITY_USER, gpt_scheduler
+from app.services.tokens import estimate_message_tokens
+from app.tracing import span
 
-openai_client = OpenAI(api_key=settings.openai_api_key)
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, AsyncStream
+    from openai.types import CompletionUsage
+    from openai.types.chat import (
+        ChatCompletion,
+        ChatCompletionChunk,
+        ChatCompletionMessageParam,
+    )
+
+    OpenStream = Tuple[AsyncStream[ChatCompletionChunk], Optional[ChatCompletionChunk]]
+
+_openai_client: Optional["AsyncOpenAI"] = None
+
+# reserved for the answer when estimating tokens per minute
+COMPLETION_TOKENS_ESTIMATE = 500
 
+_ask_hedger = Hedger("ask")
+_stream_hedger = Hedger("stream")
 
-def ask_gpt(user_text_and_context: list[dict[str, str]]) -> str:
+
+def get_openai_client() -> "AsyncOpenAI":
     """
-    Send user text to OpenAI and return response
+    Shared OpenAI client, created on first use: importing openai takes
+    ~0.5s, which the ingress role and one-off scripts never need
+    """
+    global _openai_client  # pylint: disable=global-statement
+    if _openai_client is None:
+        from openai import AsyncOpenAI  # pylint: disable=import-outside-toplevel
+
+        # 429 retries are done by gpt_scheduler, which also honors Retry-After
+        _openai_client = AsyncOpenAI(api_key=settings.openai_api_key, max_retries=0)
+    return _openai_client
+
+
+async def check_openai() -> None:
+    """
+    Readiness check: import and create the client off the event loop,
+    then fetch the configured model (also opens the first connection)
+    """
+    client = await asyncio.to_thread(get_openai_client)
+    await client.models.retrieve(settings.openai_model)
+
+
+def _estimate_request_tokens(user_text_and_context: list[dict[str, str]]) -> int:
+    prompt_tokens = sum(
+        estimate_message_tokens(msg["content"]) for msg in user_text_and_context
+    )
+    return prompt_tokens + COMPLETION_TOKENS_ESTIMATE
+
+
+def _record_usage(usage: Optional["CompletionUsage"]) -> None:
+    if usage is None:
+        return
+    OPENAI_TOKENS.labels(model=settings.openai_model, kind="prompt").inc(
+        usage.prompt_tokens
+    )
+    OPENAI_TOKENS.labels(model=settings.openai_model, kind="completion").inc(
+        usage.completion_tokens
+    )
+
+
+def _record_error(exc: Exception) -> None:
+    OPENAI_ERRORS.labels(model=settings.openai_model, error=type(exc).__name__).inc()
+
+
+def _deadline() -> Optional[float]:
+    return settings.openai_timeout or None
+
+
+class _LatencyClock:
+    """
+    OPENAI_LATENCY of one completion: time spent awaiting OpenAI from the
+    first request leaving the gpt_scheduler queue (that wait is OPENAI_QUEUE_WAIT)
+    Stream chunks add only the await itself, not the consumer's time
     """
-    response = openai_client.chat.completions.create(
-        model=settings.openai_model,
-        messages=user_text_and_context,
-        temperature=0.7,
+
+    def __init__(self) -> None:
+        self._elapsed = 0.0
+        self._started: Optional[float] = None
+
+    def start(self) -> None:
+        # retries and hedges run under the clock of the first attempt
+        if self._started is None:
+            self._started = time.perf_counter()
+
+    def stop(self) -> None:
+        if self._started is not None:
+            self._elapsed += time.perf_counter() - self._started
+            self._started = None
+
+    def observe(self, mode: str) -> None:
+        self.stop()
+        OPENAI_LATENCY.labels(model=settings.openai_model, mode=mode).observe(
+            self._elapsed
+        )
+
+
+async def _create(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    user_text_and_context: list[dict[str, str]],
+    priority: int,
+    mark_sent: Callable[[], None],
+    clock: _LatencyClock,
+    **kwargs: Any,
+) -> Any:
+    async def call() -> Any:
+        clock.start()
+        mark_sent()
+        return await get_openai_client().chat.completions.create(
+            model=settings.openai_model,
+            # history dicts are {role, content} => valid message params
+            messages=cast("list[ChatCompletionMessageParam]", user_text_and_context),
+            temperature=0.7,
+            **kwargs,
+        )
+
+    return await gpt_scheduler.run(
+        call,
+        priority=priority,
+        tokens=_estimate_request_tokens(user_text_and_context),
     )
 
+
+async def _discard_answer(_: "ChatCompletion") -> None:
+    pass
+
+
+async def _close_stream(opened: "OpenStream") -> None:
+    await opened[0].close()
+
+
+async def ask_gpt(
+    user_text_and_context: list[dict[str, str]], priority: int = PRIORITY_USER
+) -> str:
+    """
+    Send user text to OpenAI and return response
+    """
+    clock = _LatencyClock()
+    try:
+        with span("openai.ask", model=settings.openai_model, mode="ask"):
+            async with asyncio.timeout(_deadline()):
+                response: "ChatCompletion" = await _ask_hedger.run(
+                    lambda mark_sent: _create(
+                        user_text_and_context, priority, mark_sent, clock
+                    ),
+                    discard=_discard_answer,
+                )
+    except Exception as exc:
+        _record_error(exc)
+        raise
+    finally:
+        clock.observe("ask")
+    _record_usage(response.usage)
+
     raw_answer = response.choices[0].message.content
     if raw_answer is None:
         return ""
     return str(raw_answer).strip()
+
+
+async def _open_stream(
+    user_text_and_context: list[dict[str, str]],
+    priority: int,
+    mark_sent: Callable[[], None],
+    clock: _LatencyClock,
+) -> "OpenStream":
+    """
+    Start a streamed completion and wait for its first chunk
+    """
+    stream = await _create(
+        user_text_and_context,
+        priority,
+        mark_sent,
+        clock,
+        stream=True,
+        # last chunk carries token usage (with empty choices)
+        stream_options={"include_usage": True},
+    )
+    try:
+        return stream, await anext(stream, None)
+    except BaseException:
+        await stream.close()
+        raise
+
+
+async def stream_gpt(
+    user_text_and_context: list[dict[str, str]], priority: int = PRIORITY_USER
+) -> AsyncIterator[str]:
+    """
+    Send user text to OpenAI and yield response text pieces as they arrive
+    OPENAI_TIMEOUT bounds the wait for the first chunk,
+    OPENAI_STREAM_CHUNK_TIMEOUT the gaps between the next ones
+    """
+    clock = _LatencyClock()
+    try:
+        # the span ends with the first chunk: it must not stay open across yields
+        with span("openai.stream", model=settings.openai_model, mode="stream"):
+            async with asyncio.timeout(_deadline()):
+                stream, chunk = await _stream_hedger.run(
+                    lambda mark_sent: _open_stream(
+                        user_text_and_context, priority, mark_sent, clock
+                    ),
+                    discard=_close_stream,
+                )
+        clock.stop()
+
+        try:
+            while chunk is not None:
+                _record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                clock.start()
+                chunk = await asyncio.wait_for(
+                    anext(stream, None),
+                    settings.openai_stream_chunk_timeout or None,
+                )
+                clock.stop()
+        finally:
+            await stream.close()
+    except Exception as exc:
+        _record_error(exc)
+        raise
+    finally:
+        clock.observe("stream")
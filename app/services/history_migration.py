@@ -0,0 +1,183 @@
+"""
+One-off migration of chat history keys from username to tg_id
+
+    python -m app.services.history_migration [--dry-run]
+
+Moves chat_history:{username}:{role}:{thread} (and its :summary) to
+chat_history:{tg_id}:{role}:{thread}, fills the chat_index:{tg_id} sets
+and renames archived conversations in bot.chat_messages. tg_id comes from
+bot.users, "user_{tg_id}" fallback names are mapped directly. Keys of
+unknown usernames are left untouched. Safe to run more than once
+"""
+
+import argparse
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.config import logger, settings
+from app.db import ChatArchiveRepo, UserRepo
+from app.services.redis_client import close_redis
+from app.services.redis_client import redis_bytes_client as redis_client
+
+# KEYS[1] - old list, KEYS[2] - old summary, KEYS[3] - new list,
+# KEYS[4] - new summary, KEYS[5] - user's thread index
+# ARGV[1] - index member, ARGV[2] - max stored entries, ARGV[3] - index TTL
+MOVE_HISTORY_LUA = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    -- expired since SCAN saw it
+    return 0
+end
+if redis.call("EXISTS", KEYS[3]) == 0 then
+    redis.call("RENAME", KEYS[1], KEYS[3])
+else
+    -- user already wrote after the deploy: old entries go first
+    local old = redis.call("LRANGE", KEYS[1], 0, -1)
+    for i = #old, 1, -1 do
+        redis.call("LPUSH", KEYS[3], old[i])
+    end
+    redis.call("LTRIM", KEYS[3], -tonumber(ARGV[2]), -1)
+    redis.call("DEL", KEYS[1])
+end
+if redis.call("EXISTS", KEYS[2]) == 1 then
+    if redis.call("EXISTS", KEYS[4]) == 0 then
+        redis.call("RENAME", KEYS[2], KEYS[4])
+    else
+        redis.call("DEL", KEYS[2])
+    end
+end
+redis.call("SADD", KEYS[5], ARGV[1])
+redis.call("EXPIRE", KEYS[5], ARGV[3])
+return 1
+"""
+
+_move_history = redis_client.register_script(MOVE_HISTORY_LUA)
+
+
+@dataclass
+class MigrationStats:
+    moved: int = 0
+    skipped: int = 0  # already migrated or expired meanwhile
+    unknown: int = 0
+    archived_rows: int = 0
+
+
+def _resolve_tg_id(username: str, tg_ids: Dict[str, int]) -> Optional[int]:
+    if username in tg_ids:
+        return tg_ids[username]
+    # UserCache names users without a username "user_{tg_id}"
+    suffix = username.removeprefix("user_")
+    if suffix != username and suffix.isdigit():
+        return int(suffix)
+    return None
+
+
+async def _migrate_archive(
+    archive_repo: ChatArchiveRepo,
+    tg_ids: Dict[str, int],
+    stats: MigrationStats,
+    dry_run: bool,
+) -> None:
+    """
+    Rename archived conversations, including ones already evicted from Redis
+    """
+    for conversation in await archive_repo.conversations():
+        username, member = conversation.split(":", 1)
+        if username.isdigit():
+            continue
+        tg_id = _resolve_tg_id(username, tg_ids)
+        if tg_id is None:
+            logger.warning("No tg_id for archived %s, left as is", conversation)
+            continue
+        if dry_run:
+            continue
+        stats.archived_rows += await archive_repo.rename_conversation(
+            conversation, f"{tg_id}:{member}"
+        )
+        index_key = f"chat_index:{tg_id}"
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.sadd(index_key, member)
+            pipe.expire(index_key, settings.chat_ttl_seconds)
+            await pipe.execute()
+
+
+async def migrate_history_keys(dry_run: bool = False) -> MigrationStats:
+    """
+    SCAN the keyspace once and move every username-keyed history,
+    then rename the archived conversations
+    """
+    stats = MigrationStats()
+    user_repo = UserRepo()
+    await user_repo.connect()
+    try:
+        archive_repo = ChatArchiveRepo(user_repo.pool)
+        tg_ids = await user_repo.tg_ids_by_username()
+
+        async for raw_key in redis_client.scan_iter(match="chat_history:*", count=1000):
+            key = raw_key.decode()
+            parts = key.split(":")
+            # summaries move together with their lists
+            if len(parts) != 4:
+                continue
+            _, username, chatgpt_role, thread_id = parts
+            if username.isdigit():
+                # Telegram usernames are never numeric => already migrated
+                stats.skipped += 1
+                continue
+
+            tg_id = _resolve_tg_id(username, tg_ids)
+            if tg_id is None:
+                logger.warning("No tg_id for %s, left as is", key)
+                stats.unknown += 1
+                continue
+
+            member = f"{chatgpt_role}:{thread_id}"
+            new_key = f"chat_history:{tg_id}:{member}"
+            logger.info("%s -> %s", key, new_key)
+            if dry_run:
+                stats.moved += 1
+                continue
+            moved = await _move_history(
+                keys=[
+                    key,
+                    f"{key}:summary",
+                    new_key,
+                    f"{new_key}:summary",
+                    f"chat_index:{tg_id}",
+                ],
+                args=[
+                    member,
+                    settings.chat_max_stored_messages,
+                    settings.chat_ttl_seconds,
+                ],
+            )
+            if moved:
+                stats.moved += 1
+            else:
+                stats.skipped += 1
+
+        await _migrate_archive(archive_repo, tg_ids, stats, dry_run)
+    finally:
+        await user_repo.close()
+        await close_redis()
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dry-run", action="store_true", help="only log the moves")
+    args = parser.parse_args()
+
+    stats = asyncio.run(migrate_history_keys(dry_run=args.dry_run))
+    logger.info(
+        "History migration %s: moved=%s skipped=%s unknown=%s archived rows=%s",
+        "dry run" if args.dry_run else "done",
+        stats.moved,
+        stats.skipped,
+        stats.unknown,
+        stats.archived_rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,324 @@
+import asyncio
 import json
-from typing import Dict, List
+import struct
+import zlib
+from typing import (
+    Any,
+    Awaitable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
 
-import redis
+from app.chatgpt_role_prompts import CHATGPT_ROLE_PROMPTS, SUMMARY_PROMPT
+from app.config import logger, settings
+from app.metrics import REDIS_LATENCY, observe
+from app.services.chat_archive import ChatArchive
+from app.services.gpt_scheduler import PRIORITY_BACKGROUND
+from app.services.gpt_service import ask_gpt
+from app.services.redis_client import redis_bytes_client as redis_client
+from app.services.tokens import estimate_message_tokens
+from app.tracing import span
 
-from app.chatgpt_role_prompts import CHATGPT_ROLE_PROMPTS
-from app.config import settings
+# append + trim + refresh TTL (+ read recent window) in one round trip
+# KEYS[1] - history list, KEYS[2] - running summary of compacted entries,
+# KEYS[3] - user's thread index
+# ARGV[1] - max stored entries, ARGV[2] - TTL seconds,
+# ARGV[3] - recent window size to return,
+# ARGV[4] - "1" = only append to an existing list,
+# ARGV[5] - index member, ARGV[6] - index TTL seconds, ARGV[7...] - entries
+# returns -1 if the list is missing and ARGV[4] is "1",
+# list length if window is 0, else {summary or "", entries...}
+APPEND_AND_READ_LUA = """
+if ARGV[4] == "1" and redis.call("EXISTS", KEYS[1]) == 0 then
+    return -1
+end
+redis.call("RPUSH", KEYS[1], unpack(ARGV, 7))
+redis.call("LTRIM", KEYS[1], -tonumber(ARGV[1]), -1)
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+redis.call("EXPIRE", KEYS[2], ARGV[2])
+redis.call("SADD", KEYS[3], ARGV[5])
+redis.call("EXPIRE", KEYS[3], ARGV[6])
+local window = tonumber(ARGV[3])
+if window == 0 then
+    return redis.call("LLEN", KEYS[1])
+end
+local result = redis.call("LRANGE", KEYS[1], -window, -1)
+table.insert(result, 1, redis.call("GET", KEYS[2]) or "")
+return result
+"""
+
+_append_and_read = redis_client.register_script(APPEND_AND_READ_LUA)
+
+# delete all threads listed in the index and the index itself, atomically
+# KEYS[1] - user's thread index, ARGV[1] - history key prefix of the user
+# returns deleted index members
+RESET_ALL_LUA = """
+local members = redis.call("SMEMBERS", KEYS[1])
+for _, member in ipairs(members) do
+    local key = ARGV[1] .. member
+    redis.call("DEL", key, key .. ":summary")
+end
+redis.call("DEL", KEYS[1])
+return members
+"""
+
+_reset_all = redis_client.register_script(RESET_ALL_LUA)
+
+# store the new summary and cut the compacted entries, unless the list head
+# changed meanwhile (reset, trim on append, compaction by another process)
+# KEYS[1] - history list, KEYS[2] - running summary
+# ARGV[1] - new summary, ARGV[2] - TTL seconds, ARGV[3...] - compacted entries
+# returns 1 if committed, 0 if the head is no longer these entries
+COMMIT_COMPACTION_LUA = """
+local count = #ARGV - 2
+local head = redis.call("LRANGE", KEYS[1], 0, count - 1)
+if #head ~= count then
+    return 0
+end
+for i = 1, count do
+    if head[i] ~= ARGV[i + 2] then
+        return 0
+    end
+end
+redis.call("SET", KEYS[2], ARGV[1], "EX", ARGV[2])
+redis.call("LTRIM", KEYS[1], count, -1)
+return 1
+"""
+
+_commit_compaction = redis_client.register_script(COMMIT_COMPACTION_LUA)
+
+# binary history entry: tag byte, token count; "{" (0x7B) never starts it
+_HEADER = struct.Struct("<BH")
+_ROLE_TAGS = {"system": 1, "user": 2, "assistant": 3}
+_TAG_ROLES = {tag: role for role, tag in _ROLE_TAGS.items()}
+_COMPRESSED = 0x80
+
+# keep references to running compactions, one per history key
+_compactions: Dict[str, asyncio.Task] = {}
+
+# Postgres archive (CHAT_ARCHIVE), set on startup
+_archive: Optional[ChatArchive] = None
+
+
+def use_archive(archive: Optional[ChatArchive]) -> None:
+    """
+    Archive every appended turn and rehydrate evicted histories from it
+    """
+    global _archive  # pylint: disable=global-statement
+    _archive = archive
+
+
+def _key(tg_id: int, chatgpt_role: str, thread_id: int | str) -> str:
+    # tg_id, not username: usernames change (or are missing)
+    return f"chat_history:{tg_id}:{chatgpt_role}:{thread_id}"
+
+
+def _index_key(tg_id: int) -> str:
+    # set of "{chatgpt_role}:{thread_id}" the user has history in
+    return f"chat_index:{tg_id}"
+
+
+def _thread(key: str) -> Tuple[int, str]:
+    """
+    tg_id and index member of a history key
+    """
+    tg_id, member = _conversation(key).split(":", 1)
+    return int(tg_id), member
+
+
+def _summary_key(key: str) -> str:
+    return f"{key}:summary"
+
+
+def _conversation(key: str) -> str:
+    return key.removeprefix("chat_history:")
 
-redis_client = redis.Redis.from_url(
-    settings.redis_url,
-    decode_responses=True,
-)
 
+def _ttl() -> int:
+    # with the archive Redis is only a hot tier => idle histories expire sooner
+    return (
+        settings.chat_hot_ttl_seconds
+        if _archive is not None
+        else settings.chat_ttl_seconds
+    )
 
-def _key(username: str, chatgpt_role: str, thread_id: int | str) -> str:
-    return f"chat_history:{username}:{chatgpt_role}:{thread_id}"
+
+def _system_prompt(chatgpt_role: str) -> str:
+    return CHATGPT_ROLE_PROMPTS.get(chatgpt_role, CHATGPT_ROLE_PROMPTS["default"])
+
+
+def _encode(speaker_role: str, content: str, tokens: int) -> bytes:
+    """
+    Binary entry: role tag byte (+ compression flag), uint16 token count,
+    then UTF-8 content, zlib-compressed when it is long enough
+    """
+    tag = _ROLE_TAGS.get(speaker_role)
+    if settings.chat_history_format == "json" or tag is None:
+        return json.dumps(
+            {"role": speaker_role, "content": content, "tokens": tokens}
+        ).encode()
+
+    data = content.encode()
+    threshold = settings.chat_history_compress_threshold
+    if 0 < threshold <= len(data):
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            data, tag = compressed, tag | _COMPRESSED
+    return _HEADER.pack(tag, min(tokens, 0xFFFF)) + data
+
+
+def _decode(item: bytes) -> Dict[str, Any]:
+    if item[:1] == b"{":
+        # JSON entry written before the binary format (or CHAT_HISTORY_FORMAT=json)
+        entry: Dict[str, Any] = json.loads(item)
+        if "tokens" not in entry:
+            # entries stored before token budgeting
+            entry["tokens"] = estimate_message_tokens(entry["content"])
+        return entry
+
+    tag, tokens = _HEADER.unpack_from(item)
+    data = item[_HEADER.size :]
+    if tag & _COMPRESSED:
+        data = zlib.decompress(data)
+    return {
+        "role": _TAG_ROLES[tag & ~_COMPRESSED],
+        "content": data.decode(),
+        "tokens": tokens,
+    }
+
+
+def _decode_summary(summary: Optional[bytes]) -> Optional[str]:
+    return summary.decode() if summary else None
+
+
+def _summary_message(summary: str) -> Dict[str, str]:
+    return {
+        "role": "system",
+        "content": f"Summary of the earlier conversation:\n{summary}",
+    }
+
+
+def _to_openai_messages(
+    chatgpt_role: str, entries: Sequence[Dict[str, Any]], summary: Optional[str]
+) -> List[Dict[str, str]]:
+    """
+    Strip service fields. Guaranteed that system msg will be returned first,
+    followed by the summary of compacted history (if any)
+    """
+    messages = [{"role": e["role"], "content": e["content"]} for e in entries]
+
+    # check for system msg
+    has_system = any(msg["role"] == "system" for msg in messages)
+
+    if not has_system:
+        messages.insert(0, {"role": "system", "content": _system_prompt(chatgpt_role)})
+
+    if summary:
+        messages.insert(1, _summary_message(summary))
+
+    return messages
 
 
-def append_message(
-    username: str,
+async def _select_recent(
+    key: str, chatgpt_role: str, last_page: Sequence[bytes], summary: Optional[str]
+) -> List[Dict[str, Any]]:
+    """
+    Pick recent entries from last_page (tail of the list, newest last)
+
+    Without token budget - take the page as is (last MAX_HISTORY_MESSAGES).
+    With CHAT_HISTORY_TOKEN_BUDGET - walk history backwards page by page
+    until the budget is filled. Newest entry is always taken
+    """
+    if settings.chat_history_token_budget <= 0:
+        return [_decode(item) for item in last_page]
+
+    page_size = settings.chat_max_history_messages
+    budget = settings.chat_history_token_budget - estimate_message_tokens(
+        _system_prompt(chatgpt_role)
+    )
+    if summary:
+        budget -= estimate_message_tokens(_summary_message(summary)["content"])
+    selected: List[Dict[str, Any]] = []
+    used = 0
+    page, offset = list(last_page), len(last_page)
+
+    while page:
+        for item in reversed(page):
+            entry = _decode(item)
+            if selected and used + entry["tokens"] > budget:
+                return selected[::-1]
+            selected.append(entry)
+            used += entry["tokens"]
+
+        if len(page) < page_size:
+            break  # reached the oldest entry
+        with observe(REDIS_LATENCY, op="read_page"):
+            page = await cast(
+                Awaitable[List[bytes]],
+                redis_client.lrange(key, -(offset + page_size), -(offset + 1)),
+            )
+        offset += len(page)
+
+    return selected[::-1]
+
+
+async def _rehydrate(key: str) -> List[bytes]:
+    """
+    Encoded tail of an evicted history, loaded from the archive
+    """
+    if _archive is None:
+        return []
+    archived = await _archive.load_recent(
+        _conversation(key), settings.chat_rehydrate_messages
+    )
+    return [_encode(msg.speaker_role, msg.content, msg.tokens) for msg in archived]
+
+
+async def _run_append(
+    key: str, entries: Sequence[bytes], window: int, only_existing: bool
+) -> Any:
+    tg_id, member = _thread(key)
+    return await _append_and_read(
+        keys=[key, _summary_key(key), _index_key(tg_id)],
+        args=[
+            settings.chat_max_stored_messages,
+            _ttl(),
+            window,
+            "1" if only_existing else "0",
+            member,
+            # archived threads outlive their hot Redis lists
+            settings.chat_ttl_seconds,
+            *entries,
+        ],
+    )
+
+
+async def _append(key: str, speaker_role: str, content: str, window: int) -> Any:
+    # token count is computed once, on write
+    tokens = estimate_message_tokens(content)
+    entry = _encode(speaker_role, content, tokens)
+    with observe(REDIS_LATENCY, op="append" if window == 0 else "append_and_read"):
+        result = await _run_append(key, [entry], window, _archive is not None)
+    if result == -1:
+        # evicted from the hot tier (or a new conversation) => load the tail first
+        with span("history.rehydrate"):
+            entries = await _rehydrate(key)
+        with observe(REDIS_LATENCY, op="rehydrate"):
+            result = await _run_append(key, [*entries, entry], window, False)
+
+    if _archive is not None:
+        _archive.record(_conversation(key), speaker_role, content, tokens)
+    return result
+
+
+async def append_message(
+    tg_id: int,
     chatgpt_role: str,
     thread_id: int | str,
     speaker_role: str,
@@ -25,42 +326,175 @@ def append_message(
 ) -> None:
     """
     save one message of chat history in Redis
+    append, trim to keep only maximum msg and update TTL in one round trip
+    Long histories are compacted in background
     """
-    key = _key(username, chatgpt_role, thread_id)
-    entry = json.dumps({"role": speaker_role, "content": content})
+    key = _key(tg_id, chatgpt_role, thread_id)
+    length = await _append(key, speaker_role, content, 0)
 
-    # append in the end
-    redis_client.rpush(key, entry)
+    threshold = settings.chat_compaction_threshold
+    if 0 < threshold < length and key not in _compactions:
+        task = asyncio.create_task(_compact(key))
+        _compactions[key] = task
+        task.add_done_callback(lambda done: _forget_compaction(key, done))
 
-    # trim to keep only maximum msg or less
-    redis_client.ltrim(key, -settings.chat_max_stored_messages, -1)
 
-    # update TTL
-    redis_client.expire(key, settings.chat_ttl_seconds)
+def _forget_compaction(key: str, task: asyncio.Task) -> None:
+    # a cancelled compaction may already be replaced by a newer one
+    if _compactions.get(key) is task:
+        del _compactions[key]
 
 
-def get_recent_history(
-    username: str, chatgpt_role: str, thread_id: int | str
+def _cancel_compactions(keys: Iterable[str]) -> None:
+    """
+    Reset => summaries of the old history must not be written back
+    """
+    for key in list(keys):
+        task = _compactions.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+
+async def append_and_get_recent(
+    tg_id: int,
+    chatgpt_role: str,
+    thread_id: int | str,
+    speaker_role: str,
+    content: str,
 ) -> List[Dict[str, str]]:
     """
-    Get last MAX_HISTORY_MESSAGES of chat history from Redis
-    in OpenAI-ready format. Guaranteed that system msg will be returned first
+    save one message and return last MAX_HISTORY_MESSAGES of chat history
+    (including the new one) in OpenAI-ready format in one round trip
     """
-    key = _key(username, chatgpt_role, thread_id)
-    raw_items = redis_client.lrange(key, -settings.chat_max_history_messages, -1)
-    messages = [json.loads(item) for item in raw_items]
+    key = _key(tg_id, chatgpt_role, thread_id)
+    raw_summary, *raw_items = await _append(
+        key, speaker_role, content, settings.chat_max_history_messages
+    )
+    summary = _decode_summary(raw_summary)
+    entries = await _select_recent(key, chatgpt_role, raw_items, summary)
+    return _to_openai_messages(chatgpt_role, entries, summary)
 
-    # check for system msg
-    has_system = any(msg["role"] == "system" for msg in messages)
 
-    if not has_system:
-        system_prompt = CHATGPT_ROLE_PROMPTS.get(
-            chatgpt_role, CHATGPT_ROLE_PROMPTS["default"]
+async def get_recent_history(
+    tg_id: int, chatgpt_role: str, thread_id: int | str
+) -> List[Dict[str, str]]:
+    """
+    Get last MAX_HISTORY_MESSAGES (or CHAT_HISTORY_TOKEN_BUDGET worth)
+    of chat history from Redis in OpenAI-ready format.
+    Guaranteed that system msg will be returned first
+    """
+    key = _key(tg_id, chatgpt_role, thread_id)
+    with observe(REDIS_LATENCY, op="read"):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.lrange(key, -settings.chat_max_history_messages, -1)
+            pipe.get(_summary_key(key))
+            raw_items, raw_summary = await pipe.execute()
+    if not raw_items and _archive is not None:
+        with span("history.rehydrate"):
+            raw_items = await _rehydrate(key)
+        if raw_items:
+            with observe(REDIS_LATENCY, op="rehydrate"):
+                async with redis_client.pipeline(transaction=True) as pipe:
+                    pipe.rpush(key, *raw_items)
+                    pipe.ltrim(key, -settings.chat_max_stored_messages, -1)
+                    pipe.expire(key, _ttl())
+                    await pipe.execute()
+            raw_items = raw_items[-settings.chat_max_history_messages :]
+    summary = _decode_summary(raw_summary)
+    entries = await _select_recent(key, chatgpt_role, raw_items, summary)
+    return _to_openai_messages(chatgpt_role, entries, summary)
+
+
+async def reset_history(tg_id: int, chatgpt_role: str, thread_id: int | str) -> None:
+    key = _key(tg_id, chatgpt_role, thread_id)
+    _cancel_compactions([key])
+    with observe(REDIS_LATENCY, op="reset"):
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(key, _summary_key(key))
+            pipe.srem(_index_key(tg_id), _thread(key)[1])
+            await pipe.execute()
+    if _archive is not None:
+        await _archive.forget(_conversation(key))
+
+
+async def list_threads(tg_id: int) -> List[Tuple[str, str]]:
+    """
+    (chatgpt_role, thread_id) pairs the user has history in, from the index
+    Without the archive, threads whose history expired are dropped from it
+    """
+    index_key = _index_key(tg_id)
+    with observe(REDIS_LATENCY, op="list_threads"):
+        raw_members = await cast(
+            Awaitable[Set[bytes]], redis_client.smembers(index_key)
         )
-        messages.insert(0, {"role": "system", "content": system_prompt})
+        members = sorted(m.decode() for m in raw_members)
+        if members and _archive is None:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for member in members:
+                    pipe.exists(f"chat_history:{tg_id}:{member}")
+                alive = await pipe.execute()
+            expired = [m for m, exists in zip(members, alive) if not exists]
+            if expired:
+                await cast(Awaitable[int], redis_client.srem(index_key, *expired))
+            members = [m for m, exists in zip(members, alive) if exists]
+    threads = []
+    for member in members:
+        chatgpt_role, thread_id = member.rsplit(":", 1)
+        threads.append((chatgpt_role, thread_id))
+    return threads
 
-    return messages
 
+async def reset_all_history(tg_id: int) -> int:
+    """
+    Delete every thread of the user (/reset all), returns number of threads
+    """
+    prefix = f"chat_history:{tg_id}:"
+    _cancel_compactions(key for key in _compactions if key.startswith(prefix))
+    with observe(REDIS_LATENCY, op="reset_all"):
+        members = await _reset_all(
+            keys=[_index_key(tg_id)], args=[f"chat_history:{tg_id}:"]
+        )
+    if _archive is not None:
+        for member in members:
+            await _archive.forget(f"{tg_id}:{member.decode()}")
+    return len(members)
+
+
+async def _compact(key: str) -> None:
+    """
+    Fold everything except the newest CHAT_COMPACTION_KEEP entries
+    into the running summary, then drop the folded entries.
+    Runs in background, off the reply path
+    """
+    try:
+        old_items = await cast(
+            Awaitable[List[bytes]],
+            redis_client.lrange(key, 0, -(settings.chat_compaction_keep + 1)),
+        )
+        if not old_items:
+            return
+        previous_summary = _decode_summary(await redis_client.get(_summary_key(key)))
+
+        transcript = "\n".join(
+            f"{entry['role']}: {entry['content']}" for entry in map(_decode, old_items)
+        )
+        if previous_summary:
+            transcript = f"Previous summary:\n{previous_summary}\n\n{transcript}"
+        summary = await ask_gpt(
+            [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+            priority=PRIORITY_BACKGROUND,
+        )
 
-def reset_history(username: str, chatgpt_role: str, thread_id: int | str) -> None:
-    redis_client.delete(_key(username, chatgpt_role, thread_id))
+        committed = await _commit_compaction(
+            keys=[key, _summary_key(key)], args=[summary, _ttl(), *old_items]
+        )
+        if not committed:
+            # next append past the threshold starts a fresh compaction
+            logger.info("History %s changed during compaction, skipped", key)
+            return
+        logger.info("Compacted %s history entries of %s", len(old_items), key)
+    except Exception as exc:  # pylint: disable=broad-exception-caught
+        logger.exception("History compaction of %s failed: %s", key, exc)
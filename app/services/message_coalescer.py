@@ -0,0 +1,136 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+# run(merged_text, mark_saved, mark_replying) - mark_saved() is called once
+# the fragments are in history, mark_replying() right before the reply is sent
+# to user, from that point the turn is not cancelled anymore
+TurnRunner = Callable[[str, Callable[[], None], Callable[[], None]], Awaitable[None]]
+
+
+@dataclass
+class _Turn:
+    task: Optional[asyncio.Task] = None
+    saving: bool = False
+    cancel_after_save: bool = False
+    replying: bool = False
+    dropped: bool = False
+    # one per fragment this turn answers, done when it is answered
+    answers: list[asyncio.Future] = field(default_factory=list)
+
+    def mark_saved(self) -> None:
+        self.saving = False
+        if self.cancel_after_save and self.task is not None:
+            # newer fragment arrived meanwhile, its turn answers them all
+            self.task.cancel()
+
+    def mark_replying(self) -> None:
+        self.replying = True
+
+
+class MessageCoalescer:
+    """
+    Per-chat debounce of rapid text messages
+
+    Fragments arriving within window_seconds of each other are merged into
+    one user turn. A new fragment cancels the turn that is still waiting or
+    generating (its already saved fragments stay in history), but never a turn
+    that already started sending the reply - the new turn waits for it instead.
+    A turn that is saving its fragments is cancelled only once they are saved,
+    the turn that replaces it answers them too
+    """
+
+    def __init__(self, window_seconds: float) -> None:
+        self._window = window_seconds
+        # text of every fragment not taken by a turn yet, with its answer future
+        self._fragments: Dict[int, list[tuple[str, asyncio.Future]]] = {}
+        self._turns: Dict[int, _Turn] = {}
+        self._replying: Dict[int, asyncio.Task] = {}
+
+    def submit(
+        self, application: Application, update: Update, text: str, run: TurnRunner
+    ) -> "asyncio.Future[None]":
+        """
+        Add fragment and (re)start the debounce window of this chat
+        Returns future that is done once the fragment is answered (or dropped
+        by cancel()), with the error of the turn that failed to answer it.
+        Errors of the turn also go to application error handlers with this update
+        """
+        assert update.effective_chat is not None  # text messages only
+        chat_id = update.effective_chat.id
+        answered: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._fragments.setdefault(chat_id, []).append((text, answered))
+
+        previous = self._turns.get(chat_id)
+        if previous and previous.task and not previous.task.done():
+            if previous.replying:
+                self._replying[chat_id] = previous.task
+            elif previous.saving:
+                previous.cancel_after_save = True
+            else:
+                previous.task.cancel()
+
+        turn = _Turn()
+        turn.task = application.create_task(
+            self._run_turn(chat_id, turn, run), update=update
+        )
+        turn.task.add_done_callback(lambda task: self._finish(chat_id, turn, task))
+        self._turns[chat_id] = turn
+        return answered
+
+    def cancel(self, chat_id: int) -> None:
+        """
+        Drop not yet answered fragments of chat (e.g. on /reset)
+        """
+        for _, answered in self._fragments.pop(chat_id, []):
+            answered.set_result(None)
+        turn = self._turns.get(chat_id)
+        if turn and turn.task and not turn.replying:
+            turn.dropped = True
+            turn.task.cancel()
+
+    async def _run_turn(self, chat_id: int, turn: _Turn, run: TurnRunner) -> None:
+        replying = self._replying.get(chat_id)
+        if replying is not None:
+            # don't interrupt answer that is being sent, shield it from our cancel
+            await asyncio.wait([replying])
+
+        await asyncio.sleep(self._window)
+
+        fragments = self._fragments.pop(chat_id, [])
+        if not fragments:
+            return
+        turn.answers.extend(answered for _, answered in fragments)
+        # popped fragments exist only here until run() saves them
+        turn.saving = True
+        await run(
+            "\n".join(text for text, _ in fragments),
+            turn.mark_saved,
+            turn.mark_replying,
+        )
+
+    def _finish(self, chat_id: int, turn: _Turn, task: asyncio.Task) -> None:
+        if self._turns.get(chat_id) is turn:
+            del self._turns[chat_id]
+        if self._replying.get(chat_id) is task:
+            del self._replying[chat_id]
+
+        if task.cancelled() and not turn.dropped:
+            newer = self._turns.get(chat_id)
+            for answered in turn.answers:
+                if newer is None:
+                    answered.cancel()
+                else:
+                    # our fragments are in history, the newer turn answers them
+                    newer.answers.append(answered)
+            return
+        # dropped fragments count as answered: there is nothing to send
+        error = None if task.cancelled() else task.exception()
+        for answered in turn.answers:
+            if error is not None:
+                answered.set_exception(error)
+            else:
+                answered.set_result(None)
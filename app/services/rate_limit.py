@@ -0,0 +1,36 @@
+import time
+
+
+class TokenBucket:
+    """
+    Classic token bucket: refills `rate` tokens per second up to `capacity`
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """
+        Seconds to wait until `amount` tokens are available (0 = right now)
+        Amount above capacity is treated as full bucket
+        """
+        self._refill()
+        missing = min(amount, self.capacity) - self._tokens
+        return max(missing, 0.0) / self.rate
+
+    def consume(self, amount: float) -> None:
+        """
+        Take tokens, balance may go negative for amount above capacity
+        """
+        self._refill()
+        self._tokens -= amount
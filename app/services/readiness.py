@@ -0,0 +1,49 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Collection, Mapping, cast
+
+from app.config import logger
+from app.services.redis_client import redis_client
+
+ReadinessCheck = Callable[[], Awaitable[None]]
+
+
+async def check_redis() -> None:
+    await cast(Awaitable[bool], redis_client.ping())
+
+
+async def _timed(name: str, check: ReadinessCheck) -> float:
+    started = time.perf_counter()
+    await check()
+    elapsed = time.perf_counter() - started
+    logger.info("%s is ready in %.0fms", name, elapsed * 1000)
+    return elapsed
+
+
+async def wait_ready(
+    checks: Mapping[str, ReadinessCheck], optional: Collection[str] = ()
+) -> None:
+    """
+    Run readiness checks concurrently, startup waits for the slowest one
+    Failed required check => RuntimeError, failed optional one is only logged
+    """
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(_timed(name, check) for name, check in checks.items()),
+        return_exceptions=True,
+    )
+
+    failed = []
+    for name, result in zip(checks, results):
+        if not isinstance(result, BaseException):
+            continue
+        if name in optional:
+            logger.warning("%s is not ready (ignored): %r", name, result)
+        else:
+            logger.error("%s is not ready: %r", name, result)
+            failed.append(name)
+    if failed:
+        raise RuntimeError(f"Startup checks failed: {', '.join(failed)}")
+    logger.info(
+        "Startup checks passed in %.0fms", (time.perf_counter() - started) * 1000
+    )
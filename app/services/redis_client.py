@@ -0,0 +1,22 @@
+import redis.asyncio as redis
+
+from app.config import settings
+
+redis_client: redis.Redis = redis.Redis.from_url(
+    settings.redis_url,
+    decode_responses=True,
+)
+
+# raw bytes (chat history is stored in a binary format)
+redis_bytes_client: redis.Redis = redis.Redis.from_url(
+    settings.redis_url,
+    decode_responses=False,
+)
+
+
+async def close_redis() -> None:
+    """
+    Close Redis connection pools on bot shutdown
+    """
+    await redis_client.aclose()
+    await redis_bytes_client.aclose()
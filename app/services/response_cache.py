@@ -0,0 +1,144 @@
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import redis.asyncio as redis
+
+from app.config import settings
+from app.metrics import RESPONSE_CACHE_LOOKUPS
+
+_SPACES_RE = re.compile(r"\s+")
+
+# sorted set of cached keys by write time, bounds the Redis tier
+INDEX_KEY = "gpt_cache:index"
+
+# KEYS[1] - answer, KEYS[2] - index
+# ARGV[1] - answer, ARGV[2] - TTL, ARGV[3] - now, ARGV[4] - max entries
+PUT_ANSWER_LUA = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+-- answers that expired on their own
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', tonumber(ARGV[3]) - tonumber(ARGV[2]))
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if excess > 0 then
+    local oldest = redis.call('ZPOPMIN', KEYS[2], excess)
+    for i = 1, #oldest, 2 do
+        redis.call('DEL', oldest[i])
+    end
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+@dataclass
+class ResponseCacheStats:
+    memory_hits: int = 0
+    redis_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.redis_hits + self.misses
+        return (self.memory_hits + self.redis_hits) / total if total else 0.0
+
+
+def _normalize(text: str) -> str:
+    return _SPACES_RE.sub(" ", text).strip().lower()
+
+
+class ResponseCache:
+    """
+    Cache of GPT answers for repeated prompts, opt-in per chatgpt role
+
+    Key is a hash of the model and the whole prompt it sees (system prompt,
+    summary and every history message) with normalized whitespace and case:
+    an answer is only reused for the same conversation context, never across
+    users with different histories. In-process LRU first,
+    Redis (optional) as shared tier. Both tiers expire entries after TTL,
+    the Redis one also keeps at most RESPONSE_CACHE_REDIS_MAX_ENTRIES answers
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None) -> None:
+        self._roles = settings.response_cache_roles
+        self._max_entries = settings.response_cache_max_entries
+        self._ttl_seconds = settings.response_cache_ttl_seconds
+        self._redis = redis_client
+        self._put_answer = (
+            redis_client.register_script(PUT_ANSWER_LUA)
+            if redis_client is not None
+            else None
+        )
+        self._lru: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.stats = ResponseCacheStats()
+
+    def enabled_for(self, chatgpt_role: str) -> bool:
+        return chatgpt_role in self._roles
+
+    def _key(self, messages: List[Dict[str, str]]) -> str:
+        context = [[msg["role"], _normalize(msg["content"])] for msg in messages]
+        raw = json.dumps([settings.openai_model, context])
+        return "gpt_cache:" + hashlib.sha256(raw.encode()).hexdigest()
+
+    async def get(
+        self, chatgpt_role: str, messages: List[Dict[str, str]]
+    ) -> Optional[str]:
+        if not self.enabled_for(chatgpt_role):
+            return None
+
+        key = self._key(messages)
+        cached = self._lru.get(key)
+        if cached is not None:
+            answer, expires_at = cached
+            if expires_at > time.time():
+                self._lru.move_to_end(key)
+                self.stats.memory_hits += 1
+                RESPONSE_CACHE_LOOKUPS.labels(result="memory_hit").inc()
+                return answer
+            del self._lru[key]
+
+        if self._redis is not None:
+            answer = await self._redis.get(key)
+            if answer is not None:
+                self._remember(key, answer)
+                self.stats.redis_hits += 1
+                RESPONSE_CACHE_LOOKUPS.labels(result="redis_hit").inc()
+                return str(answer)
+
+        self.stats.misses += 1
+        RESPONSE_CACHE_LOOKUPS.labels(result="miss").inc()
+        return None
+
+    async def put(
+        self, chatgpt_role: str, messages: List[Dict[str, str]], answer: str
+    ) -> None:
+        if not self.enabled_for(chatgpt_role) or not answer:
+            return
+        if len(answer) > settings.response_cache_max_answer_len:
+            return
+
+        key = self._key(messages)
+        self._remember(key, answer)
+        if self._put_answer is not None:
+            await self._put_answer(
+                keys=[key, INDEX_KEY],
+                args=[
+                    answer,
+                    self._ttl_seconds,
+                    time.time(),
+                    settings.response_cache_redis_max_entries,
+                ],
+            )
+
+    def _remember(self, key: str, answer: str) -> None:
+        self._lru[key] = (answer, time.time() + self._ttl_seconds)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self._max_entries:
+            self._lru.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._lru)
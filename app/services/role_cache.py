@@ -0,0 +1,170 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Optional
+
+import redis.asyncio as redis
+from redis.asyncio.client import PubSub
+
+from app.config import logger
+from app.db import UserRepo
+from app.models.telegram_user import TelegramUserData
+
+Profile = tuple[str, Optional[str], Optional[str]]
+
+# tg_id of a user whose role changed, published to every bot process
+INVALIDATE_CHANNEL = "user_role:invalidate"
+
+
+@dataclass
+class _RoleEntry:
+    role: str
+    profile: Profile
+    expires_at: float
+
+
+def _profile(user: TelegramUserData) -> Profile:
+    return (user.username, user.first_name, user.last_name)
+
+
+class RoleCache:
+    """
+    TTL cache of user roles in front of UserRepo
+    Memory first (LRU, at most max_size roles), Redis (optional) as shared
+    layer between bot processes. Postgres upsert runs only on cache
+    miss/expiry or when profile changed. Invalidations are published via
+    Redis pub/sub (pubsub_client), so every process drops the role at once
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        user_repo: UserRepo,
+        ttl_seconds: int,
+        max_size: int = 0,
+        redis_client: Optional[redis.Redis] = None,
+        pubsub_client: Optional[redis.Redis] = None,
+    ) -> None:
+        self._user_repo = user_repo
+        self._ttl_seconds = ttl_seconds
+        self._max_size = max_size
+        self._redis = redis_client
+        self._pubsub_client = pubsub_client
+        # tg_id -> entry, least recently used first
+        self._by_id: OrderedDict[int, _RoleEntry] = OrderedDict()
+        self._listener: Optional[asyncio.Task] = None
+
+        # role changed in DB (e.g. /add) => drop cached entry immediately
+        user_repo.add_role_listener(self.invalidate)
+
+    @staticmethod
+    def _key(tg_id: int) -> str:
+        return f"user_role:{tg_id}"
+
+    async def resolve(self, user: TelegramUserData) -> str:
+        """
+        Return user role, create/update user in DB only when required
+        """
+        profile = _profile(user)
+        now = time.time()
+
+        entry = self._by_id.get(user.tg_id)
+        if entry is None and self._redis is not None:
+            entry = await self._get_shared(user.tg_id)
+
+        if entry and entry.expires_at > now and entry.profile == profile:
+            self._remember(user.tg_id, entry, now)
+            return entry.role
+
+        role = await self._user_repo.upsert_and_get_role(user)
+        entry = _RoleEntry(
+            role=role, profile=profile, expires_at=now + self._ttl_seconds
+        )
+        self._remember(user.tg_id, entry, now)
+        if self._redis is not None:
+            await self._set_shared(user.tg_id, entry)
+        return role
+
+    def _remember(self, tg_id: int, entry: _RoleEntry, now: float) -> None:
+        self._by_id[tg_id] = entry
+        self._by_id.move_to_end(tg_id)
+        # expired roles are dropped from the LRU end, the rest on lookup
+        while self._by_id:
+            oldest = next(iter(self._by_id.values()))
+            if oldest.expires_at > now:
+                break
+            self._by_id.popitem(last=False)
+        while len(self._by_id) > self._max_size > 0:
+            self._by_id.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    async def invalidate(self, tg_id: int) -> None:
+        self._by_id.pop(tg_id, None)
+        if self._redis is not None:
+            await self._redis.delete(self._key(tg_id))
+        if self._pubsub_client is not None:
+            await self._pubsub_client.publish(INVALIDATE_CHANNEL, tg_id)
+
+    def clear(self) -> None:
+        """
+        Completely clear in-memory role cache
+        """
+        self._by_id.clear()
+
+    async def start(self) -> None:
+        """
+        Subscribe to invalidations published by other bot processes
+        """
+        if self._pubsub_client is None:
+            return
+        pubsub = self._pubsub_client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(INVALIDATE_CHANNEL)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._listener
+            self._listener = None
+
+    async def _listen(self, pubsub: PubSub) -> None:
+        try:
+            while True:
+                try:
+                    async for message in pubsub.listen():
+                        self._by_id.pop(int(message["data"]), None)
+                except redis.RedisError as exc:
+                    # invalidations published meanwhile are lost
+                    logger.warning("Role invalidations lost (%s), cache cleared", exc)
+                    self.clear()
+                    await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+    async def _get_shared(self, tg_id: int) -> Optional[_RoleEntry]:
+        assert self._redis is not None
+        raw = await self._redis.get(self._key(tg_id))
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return _RoleEntry(
+            role=data["role"],
+            profile=tuple(data["profile"]),
+            expires_at=data["expires_at"],
+        )
+
+    async def _set_shared(self, tg_id: int, entry: _RoleEntry) -> None:
+        assert self._redis is not None
+        raw = json.dumps(
+            {
+                "role": entry.role,
+                "profile": list(entry.profile),
+                "expires_at": entry.expires_at,
+            }
+        )
+        await self._redis.set(self._key(tg_id), raw, ex=self._ttl_seconds)
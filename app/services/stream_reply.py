@@ -0,0 +1,103 @@
+import time
+from typing import AsyncIterator, Optional
+
+from telegram import Message
+from telegram.error import BadRequest
+
+from app.config import settings
+from app.services.telegram_sender import TelegramSender
+from app.services.update_dedup import forget_reply
+
+PLACEHOLDER = "…"
+
+
+class StreamingReply:
+    """
+    Render streamed GPT answer in Telegram: post a placeholder message
+    and update it with throttled edits, roll over to a new message
+    when telegram_msg_max_len is reached
+    """
+
+    def __init__(self, reply_to: Message, sender: TelegramSender) -> None:
+        self._reply_to = reply_to
+        self._sender = sender
+        self._message: Optional[Message] = None
+        self._message_text = ""  # text of the currently edited message
+        self._shown_len = 0  # length of _message_text visible in Telegram
+        self._last_edit_at = 0.0
+        self._full_text: list[str] = []
+
+    async def start(self) -> None:
+        self._message = await self._sender.reply_text(self._reply_to, PLACEHOLDER)
+        self._last_edit_at = time.monotonic()
+
+    async def feed(self, delta: str) -> None:
+        self._full_text.append(delta)
+        max_len = settings.telegram_msg_max_len
+
+        while len(self._message_text) + len(delta) > max_len:
+            # close current message with what fits and continue in a new one
+            free = max_len - len(self._message_text)
+            self._message_text += delta[:free]
+            delta = delta[free:]
+            await self._edit(force=True)
+            self._message = await self._sender.reply_text(self._reply_to, PLACEHOLDER)
+            self._message_text = ""
+            self._shown_len = 0
+
+        self._message_text += delta
+        await self._edit(force=False)
+
+    async def finish(self) -> str:
+        """
+        Flush last edit and return the whole answer
+        """
+        await self._edit(force=True)
+        return "".join(self._full_text).strip()
+
+    async def discard_if_empty(self) -> None:
+        if self._message is not None and not self._full_text:
+            await self._message.delete()
+            forget_reply(self._message.message_id)
+            self._message = None
+
+    async def _edit(self, force: bool) -> None:
+        if self._message is None:
+            raise RuntimeError("StreamingReply is not started, call start() first")
+
+        new_chars = len(self._message_text) - self._shown_len
+        if new_chars <= 0:
+            return
+        if not force and (
+            new_chars < settings.stream_edit_min_chars
+            or time.monotonic() - self._last_edit_at < settings.stream_edit_interval
+        ):
+            return
+
+        text = self._message_text.strip() or PLACEHOLDER
+        try:
+            await self._sender.edit_text(self._message, text)
+        except BadRequest as exc:
+            # same text after strip() - nothing to update
+            if "not modified" not in str(exc).lower():
+                raise
+        self._shown_len = len(self._message_text)
+        self._last_edit_at = time.monotonic()
+
+
+async def stream_answer(
+    reply_to: Message, chunks: AsyncIterator[str], sender: TelegramSender
+) -> str:
+    """
+    Stream GPT answer chunks into Telegram messages, return the whole answer
+    """
+    reply = StreamingReply(reply_to, sender)
+    await reply.start()
+    try:
+        async for delta in chunks:
+            await reply.feed(delta)
+    except Exception:
+        # failed before the first piece => don't leave the placeholder hanging
+        await reply.discard_if_empty()
+        raise
+    return await reply.finish()
@@ -1,23 +1,61 @@
-from typing import Any
+import asyncio
+import signal
+from typing import Any, Awaitable, Callable, Optional, Protocol
 
+from telegram import Update
 from telegram.ext import (
     Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
+from telegram.request import BaseRequest
 
 from app.config import logger, settings
 from app.handlers import add_command, handle_message, reset_command, start_command
 from app.handlers.errors import error_handler
+from app.metrics import HandlerCallback, timed_handler
+from app.services.update_dedup import idempotent
+from app.services.update_processor import ChatOrderedUpdateProcessor
+from app.services.update_stream import UpdateStreamPublisher, UpdateStreamWorker
+
+LifecycleHook = Callable[[], Awaitable[None]]
+
+
+def _wrap(callback: HandlerCallback) -> HandlerCallback:
+    # latency includes the idempotency check (and replays)
+    return timed_handler(idempotent(callback))
+
+
+class UpdateSource(Protocol):
+    async def start(self) -> None: ...
+
+    async def stop(self) -> None: ...
 
 
 class TelegramApp:
-    def __init__(self) -> None:
-        self.app: Application = (
-            ApplicationBuilder().token(settings.telegram_bot_token).build()
+    def __init__(self, request: Optional[BaseRequest] = None) -> None:
+        self.update_processor = ChatOrderedUpdateProcessor(
+            max_concurrent_updates=settings.update_max_concurrency,
+            max_pending_updates=settings.update_max_pending,
+            stats_log_interval=settings.update_stats_log_interval,
         )
+        builder = (
+            ApplicationBuilder()
+            .token(settings.telegram_bot_token)
+            # concurrent across chats, serial inside one chat
+            .concurrent_updates(self.update_processor)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+        )
+        if request is not None:
+            # custom transport for Bot API calls (e.g. fake one in bench/)
+            builder = builder.request(request)
+        self.app: Application = builder.build()
+        self._startup_hooks: list[LifecycleHook] = []
+        self._shutdown_hooks: list[LifecycleHook] = []
 
     def with_dependencies(self, **deps: Any) -> "TelegramApp":
         """
@@ -26,17 +64,92 @@ class TelegramApp:
         self.app.bot_data.update(deps)
         return self
 
+    def on_startup(self, hook: LifecycleHook) -> "TelegramApp":
+        """
+        Await hook inside the bot event loop before polling starts
+        (e.g. open async DB connection)
+        """
+        self._startup_hooks.append(hook)
+        return self
+
+    def on_shutdown(self, hook: LifecycleHook) -> "TelegramApp":
+        """
+        Await hook after the bot is stopped. Hooks run in reverse order
+        """
+        self._shutdown_hooks.append(hook)
+        return self
+
+    async def _post_init(self, _: Application) -> None:
+        for hook in self._startup_hooks:
+            await hook()
+
+    async def _post_shutdown(self, _: Application) -> None:
+        for hook in reversed(self._shutdown_hooks):
+            await hook()
+
     def register(self) -> "TelegramApp":
-        self.app.add_handler(CommandHandler("start", start_command))
-        self.app.add_handler(CommandHandler("reset", reset_command))
-        self.app.add_handler(CommandHandler("add", add_command))
+        self.app.add_handler(CommandHandler("start", _wrap(start_command)))
+        self.app.add_handler(CommandHandler("reset", _wrap(reset_command)))
+        self.app.add_handler(CommandHandler("add", _wrap(add_command)))
         self.app.add_handler(
-            MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message)
+            MessageHandler(filters.TEXT & (~filters.COMMAND), _wrap(handle_message))
         )
         self.app.add_error_handler(error_handler)
         logger.info("Handlers registered")
         return self
 
+    def register_ingress(self, publisher: UpdateStreamPublisher) -> "TelegramApp":
+        """
+        Ingress role: every update is only forwarded to Redis Streams
+        """
+        self.app.add_handler(TypeHandler(Update, publisher.forward))
+        self.app.add_error_handler(error_handler)
+        logger.info("Ingress handler registered")
+        return self
+
     def run(self) -> None:
+        if settings.bot_role == "worker":
+            asyncio.run(self._serve(UpdateStreamWorker(self.app)))
+            return
+        if settings.telegram_mode == "webhook":
+            # aiohttp is only needed here, keep it out of the import path
+            # pylint: disable-next=import-outside-toplevel
+            from app.services.webhook_server import WebhookServer
+
+            asyncio.run(self._serve(WebhookServer(self.app)))
+            return
+
         logger.info("Starting polling Telegram for updates...")
         self.app.run_polling()
+
+    async def _serve(self, source: UpdateSource) -> None:
+        """
+        Same lifecycle as run_polling(), but updates come from another source
+        """
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        await self.start()
+        try:
+            await source.start()
+            await stop.wait()
+        finally:
+            await source.stop()
+            await self.stop()
+
+    async def start(self) -> None:
+        """
+        Initialize application, run startup hooks and start processing
+        update_queue. For embedding into an already running event loop
+        """
+        # getMe and startup hooks (readiness checks) are independent
+        await asyncio.gather(self.app.initialize(), self._post_init(self.app))
+        await self.app.start()
+
+    async def stop(self) -> None:
+        if self.app.running:
+            await self.app.stop()
+        await self.app.shutdown()
+        await self._post_shutdown(self.app)
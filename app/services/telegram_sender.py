@@ -0,0 +1,209 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from telegram import Message
+from telegram.error import RetryAfter
+
+from app.config import logger, settings
+from app.services.rate_limit import TokenBucket
+from app.services.update_dedup import record_reply
+from app.tracing import span
+
+T = TypeVar("T")
+
+FENCE = "```"
+# room for closing/reopening a code fence when a chunk is cut inside it
+_FENCE_RESERVE = 64
+
+# drop idle per-chat buckets when there are more than this many
+_MAX_CHAT_BUCKETS = 10_000
+
+
+def _wrap_line(line: str, width: int) -> list[str]:
+    """
+    Cut a single overlong line, preferably at spaces
+    """
+    pieces = []
+    while len(line) > width:
+        cut = line.rfind(" ", 0, width)
+        if cut <= 0:
+            cut = width
+        pieces.append(line[:cut])
+        line = line[cut:].lstrip(" ")
+    pieces.append(line)
+    return pieces
+
+
+def _paragraphs(text: str) -> list[str]:
+    """
+    Split text by blank lines, blank lines inside code fences don't count
+    """
+    blocks: list[str] = []
+    current: list[str] = []
+    in_fence = False
+    for line in text.split("\n"):
+        if line.strip().startswith(FENCE):
+            in_fence = not in_fence
+        if not line.strip() and not in_fence:
+            if current:
+                blocks.append("\n".join(current))
+                current = []
+            continue
+        current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def _split_block(block: str, max_len: int) -> list[str]:
+    """
+    Split one paragraph/code block by lines, close and reopen code fence
+    at every cut so each part renders correctly on its own
+    """
+    width = max(max_len - _FENCE_RESERVE, max_len // 2)
+    parts: list[str] = []
+    current: list[str] = []
+    fence: Optional[str] = None  # opening line of the fence we are inside
+
+    for line in block.split("\n"):
+        for piece in _wrap_line(line, width):
+            closing = len(FENCE) + 1 if fence else 0
+            if current and len("\n".join(current + [piece])) + closing > max_len:
+                if fence:
+                    current.append(FENCE)
+                parts.append("\n".join(current))
+                current = [fence] if fence else []
+            current.append(piece)
+        if line.strip().startswith(FENCE):
+            fence = None if fence else line.strip()
+
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+
+def split_message(text: str, max_len: int) -> list[str]:
+    """
+    Split long answer into Telegram-sized messages
+    Cuts between paragraphs first, then between lines, then at spaces.
+    Never leaves a code fence unclosed in a message
+    """
+    if len(text) <= max_len:
+        return [text]
+
+    chunks: list[str] = []
+    current = ""
+    for block in _paragraphs(text):
+        for part in _split_block(block, max_len) if len(block) > max_len else [block]:
+            if current and len(current) + 2 + len(part) <= max_len:
+                current = f"{current}\n\n{part}"
+                continue
+            if current:
+                chunks.append(current)
+            current = part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class TelegramSender:
+    """
+    Outbound delivery of GPT answers
+
+    Global and per-chat token buckets keep us below Telegram limits
+    (~30 msg/s per bot, ~1 msg/s per chat), RetryAfter (flood wait)
+    is honored and the request retried
+    """
+
+    def __init__(self) -> None:
+        self._global = TokenBucket(
+            settings.telegram_global_rate, settings.telegram_global_rate
+        )
+        self._chats: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _MAX_CHAT_BUCKETS:
+                self._drop_idle_buckets()
+            bucket = TokenBucket(
+                settings.telegram_chat_rate, settings.telegram_chat_burst
+            )
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _drop_idle_buckets(self) -> None:
+        # full bucket behaves exactly like a new one
+        idle = [
+            chat_id
+            for chat_id, bucket in self._chats.items()
+            if bucket.time_until(bucket.capacity) == 0
+        ]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    async def _wait_turn(self, chat_id: int) -> None:
+        chat = self._chat_bucket(chat_id)
+        while True:
+            delay = max(self._global.time_until(1), chat.time_until(1))
+            if delay <= 0:
+                self._global.consume(1)
+                chat.consume(1)
+                return
+            await asyncio.sleep(delay)
+
+    async def _call(
+        self, chat_id: int, method: str, request: Callable[[], Awaitable[T]]
+    ) -> T:
+        with span(f"telegram.{method}"):
+            return await self._call_with_retries(chat_id, request)
+
+    async def _call_with_retries(
+        self, chat_id: int, request: Callable[[], Awaitable[T]]
+    ) -> T:
+        for _ in range(settings.telegram_max_retries):
+            await self._wait_turn(chat_id)
+            try:
+                return await request()
+            except RetryAfter as exc:
+                logger.warning(
+                    "Telegram flood control for chat %s, retry in %ss",
+                    chat_id,
+                    exc.retry_after,
+                )
+                await asyncio.sleep(exc.retry_after)
+        await self._wait_turn(chat_id)
+        return await request()
+
+    async def reply_text(self, reply_to: Message, text: str) -> Message:
+        message = await self._call(
+            reply_to.chat_id, "reply_text", lambda: reply_to.reply_text(text)
+        )
+        record_reply(text, message.message_id)
+        return message
+
+    async def edit_text(self, message: Message, text: str) -> None:
+        await self._call(message.chat_id, "edit_text", lambda: message.edit_text(text))
+        record_reply(text, message.message_id)
+
+    async def send_answer(self, reply_to: Message, answer: str) -> None:
+        """
+        Send answer split by paragraphs/code blocks, or as a single file
+        when it is longer than TELEGRAM_FILE_THRESHOLD
+        """
+        threshold = settings.telegram_file_threshold
+        if 0 < threshold < len(answer):
+            await self._call(
+                reply_to.chat_id,
+                "reply_document",
+                lambda: reply_to.reply_document(
+                    document=answer.encode(),
+                    filename="answer.md",
+                    caption="📄 The answer is long, sending it as a file.",
+                ),
+            )
+            record_reply(answer, document=True)
+            return
+
+        for chunk in split_message(answer, settings.telegram_msg_max_len):
+            await self.reply_text(reply_to, chunk)
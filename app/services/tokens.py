@@ -0,0 +1,30 @@
+import math
+import re
+
+# OpenAI chat format adds a few service tokens around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Offline estimate of OpenAI token count for text
+
+    No tokenizer download required: latin words cost ~1 token per 4 chars,
+    non-latin (e.g. cyrillic) words ~1 token per 2 chars, punctuation 1 token.
+    Precise enough for budgeting prompt size
+    """
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        if not piece[0].isalnum() and piece[0] != "_":
+            tokens += 1
+        elif piece.isascii():
+            tokens += math.ceil(len(piece) / 4)
+        else:
+            tokens += math.ceil(len(piece) / 2)
+    return tokens
+
+
+def estimate_message_tokens(content: str) -> int:
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
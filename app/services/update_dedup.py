@@ -0,0 +1,272 @@
+# pylint: disable=too-many-instance-attributes
+import asyncio
+import json
+import uuid
+from contextlib import suppress
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+import redis.asyncio as redis
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from app.config import logger, settings
+from app.metrics import UPDATE_DEDUP, HandlerCallback
+from app.services.update_processor import defer_update
+from app.services.update_stream import RELEASE_LEASE_LUA
+from app.tracing import span
+
+# value of a claimed update that is not finished yet, followed by ":<owner>"
+PROCESSING = "processing"
+
+# owner key of a running process, a claim whose owner key expired is taken over
+OWNER_TTL_SECONDS = 30
+
+# claim of a dead owner (ARGV[1], owner key KEYS[2] gone) => ours (ARGV[2])
+TAKE_OVER_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 and redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+_reply_log: ContextVar[Optional["ReplyLog"]] = ContextVar("reply_log", default=None)
+
+
+class ReplyLog:
+    """
+    Replies sent through TelegramSender while handling one update, in order
+    A streamed message is kept with its latest text
+    """
+
+    def __init__(self) -> None:
+        self.entries: List[Dict[str, str]] = []
+        self._by_message: Dict[int, Dict[str, str]] = {}
+
+    def record(
+        self, text: str, message_id: Optional[int] = None, document: bool = False
+    ) -> None:
+        entry = self._by_message.get(message_id) if message_id is not None else None
+        if entry is None:
+            entry = {"kind": "document" if document else "text", "text": text}
+            self.entries.append(entry)
+            if message_id is not None:
+                self._by_message[message_id] = entry
+        else:
+            entry["text"] = text
+
+    def forget(self, message_id: int) -> None:
+        entry = self._by_message.pop(message_id, None)
+        if entry is not None:
+            self.entries.remove(entry)
+
+
+def record_reply(
+    text: str, message_id: Optional[int] = None, document: bool = False
+) -> None:
+    """
+    Called by TelegramSender for every sent or edited message
+    """
+    log = _reply_log.get()
+    if log is not None:
+        log.record(text, message_id, document)
+
+
+def forget_reply(message_id: int) -> None:
+    """
+    Sent message was deleted (e.g. placeholder of a failed stream)
+    """
+    log = _reply_log.get()
+    if log is not None:
+        log.forget(message_id)
+
+
+class UpdateDedup:
+    """
+    Idempotent update handling across restarts, webhook retries and instances
+
+    update_id is claimed with SET NX for UPDATE_DEDUP_LEASE_SECONDS. A finished
+    update keeps the replies sent for it for UPDATE_DEDUP_TTL_SECONDS: its
+    redelivery re-sends them instead of calling OpenAI and writing history again
+
+    The claim names its owner process, which keeps an owner key alive while it
+    runs: a redelivered update claimed by a dead process is handled again
+    """
+
+    def __init__(
+        self, redis_client: redis.Redis, ttl_seconds: int, lease_seconds: int
+    ) -> None:
+        self._redis = redis_client
+        self._ttl_seconds = ttl_seconds
+        self._lease_seconds = lease_seconds
+        # unique per process: a restarted worker with the same WORKER_ID
+        # must not mistake the claims of its previous run for its own
+        self._owner = f"{settings.worker_id}:{uuid.uuid4().hex[:8]}"
+        self._processing = f"{PROCESSING}:{self._owner}"
+        self._take_over = redis_client.register_script(TAKE_OVER_LUA)
+        # deletes the claim only while it is still ours
+        self._release = redis_client.register_script(RELEASE_LEASE_LUA)
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(update_id: int) -> str:
+        return f"update_dedup:{update_id}"
+
+    @staticmethod
+    def _owner_key(owner: str) -> str:
+        return f"update_dedup:owner:{owner}"
+
+    async def start(self) -> None:
+        """
+        Keep the owner key of this process alive
+        """
+        await self._touch_owner()
+        self._heartbeat = asyncio.create_task(self._keep_owner_alive())
+
+    async def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._heartbeat
+            self._heartbeat = None
+        # updates still claimed by us can be taken over right away
+        await self._redis.delete(self._owner_key(self._owner))
+
+    async def _touch_owner(self) -> None:
+        await self._redis.set(self._owner_key(self._owner), 1, ex=OWNER_TTL_SECONDS)
+
+    async def _keep_owner_alive(self) -> None:
+        while True:
+            await asyncio.sleep(OWNER_TTL_SECONDS / 3)
+            try:
+                await self._touch_owner()
+            except redis.RedisError as exc:
+                logger.warning("Failed to refresh update dedup owner: %s", exc)
+
+    async def claim(self, update_id: int) -> Optional[str]:
+        """
+        None if the update is ours to handle, else its state:
+        PROCESSING or JSON list of the replies sent for it
+        """
+        key = self._key(update_id)
+        if await self._redis.set(
+            key, self._processing, nx=True, ex=self._lease_seconds
+        ):
+            return None
+        state: Optional[str] = await self._redis.get(key)
+        if state is None:
+            # expired right between the calls => treat as still in flight
+            return PROCESSING
+        if not state.startswith(f"{PROCESSING}:"):
+            return state
+        owner = state[len(PROCESSING) + 1 :]
+        if owner != self._owner and await self._take_over(
+            keys=[key, self._owner_key(owner)],
+            args=[state, self._processing, self._lease_seconds],
+        ):
+            logger.info(
+                "Update %s was claimed by stopped worker %s, taking over",
+                update_id,
+                owner,
+            )
+            return None
+        return PROCESSING
+
+    async def complete(self, update_id: int, log: ReplyLog) -> None:
+        await self._redis.set(
+            self._key(update_id), json.dumps(log.entries), ex=self._ttl_seconds
+        )
+
+    async def release(self, update_id: int) -> None:
+        await self._release(keys=[self._key(update_id)], args=[self._processing])
+
+    async def handle(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        callback: HandlerCallback,
+    ) -> Any:
+        update_id = update.update_id
+        with span("update_dedup.claim"):
+            state = await self.claim(update_id)
+        if state == PROCESSING:
+            UPDATE_DEDUP.labels(result="in_flight").inc()
+            logger.info("Update %s is already being handled, skipped", update_id)
+            return None
+        if state is not None:
+            UPDATE_DEDUP.labels(result="replayed").inc()
+            await self._replay(update, context, json.loads(state))
+            return None
+
+        UPDATE_DEDUP.labels(result="processed").inc()
+        log = ReplyLog()
+        token = _reply_log.set(log)
+        try:
+            result = await callback(update, context)
+        except BaseException:
+            # failed or cancelled (e.g. shard lease lost) => let the
+            # redelivery of this update try again
+            await self.release(update_id)
+            raise
+        finally:
+            _reply_log.reset(token)
+        if isinstance(result, asyncio.Future):
+            # answered in background (MessageCoalescer), whose task inherited
+            # our reply log: the update is done once the answer is sent
+            completed = asyncio.ensure_future(
+                self._complete_after(update_id, log, result)
+            )
+            defer_update(completed)
+            return completed
+        await self.complete(update_id, log)
+        return result
+
+    async def _complete_after(
+        self, update_id: int, log: ReplyLog, answered: "asyncio.Future[Any]"
+    ) -> None:
+        try:
+            # our cancel (e.g. shard lease lost) must not cancel the turn
+            await asyncio.shield(answered)
+        except BaseException:
+            await self.release(update_id)
+            raise
+        await self.complete(update_id, log)
+
+    @staticmethod
+    async def _replay(
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        entries: List[Dict[str, str]],
+    ) -> None:
+        logger.info(
+            "Update %s was already handled, re-sending %s replies",
+            update.update_id,
+            len(entries),
+        )
+        message = update.effective_message
+        if message is None:
+            return
+        sender = context.application.bot_data["telegram_sender"]
+        for entry in entries:
+            if entry["kind"] == "document":
+                await sender.send_answer(message, entry["text"])
+            else:
+                await sender.reply_text(message, entry["text"])
+
+
+def idempotent(callback: HandlerCallback) -> HandlerCallback:
+    """
+    Wrap handler callback with UpdateDedup from bot_data["update_dedup"]
+    (no-op when it is not configured)
+    """
+
+    @wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        dedup: Optional[UpdateDedup] = context.application.bot_data.get("update_dedup")
+        if dedup is None:
+            return await callback(update, context)
+        return await dedup.handle(update, context, callback)
+
+    return wrapper
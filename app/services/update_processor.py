@@ -0,0 +1,188 @@
+# pylint: disable=too-many-instance-attributes
+import asyncio
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from app.config import logger
+from app.tracing import span, trace_update
+
+# work the handlers of the current update left running, see defer_update()
+_deferred: ContextVar[Optional[List["asyncio.Future[Any]"]]] = ContextVar(
+    "deferred_update_work", default=None
+)
+
+
+def defer_update(future: "asyncio.Future[Any]") -> None:
+    """
+    The update is handled once future is done, not when its handler returns
+    (e.g. a MessageCoalescer turn answers it in background)
+    """
+    deferred = _deferred.get()
+    if deferred is not None:
+        deferred.append(future)
+
+
+async def _wait_deferred(deferred: List["asyncio.Future[Any]"]) -> None:
+    # not gather(): cancelling us must not cancel the work itself
+    await asyncio.wait(deferred)
+    for future in deferred:
+        if not future.cancelled():
+            # errors already reached the error handlers, like handler errors
+            future.exception()
+
+
+@dataclass(frozen=True)
+class UpdateProcessorStats:
+    in_flight: int
+    queued: int
+    busiest_chat_depth: int
+    processed: int
+    avg_wait_seconds: float
+    max_wait_seconds: float
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates concurrently, but strictly one after another inside one chat
+
+    Base class semaphore only bounds admitted (pending + running) updates.
+    Per-chat lock is taken before our own concurrency slot, so messages queued
+    behind a slow GPT call of one user don't occupy slots of other chats.
+    Work deferred by the handler (defer_update) is awaited after both are
+    released: the update is only done (stream entry acked, trace closed) then
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates: int,
+        max_pending_updates: int,
+        stats_log_interval: float = 0.0,
+    ) -> None:
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._stats_log_interval = stats_log_interval
+        self._stats_task: Optional[asyncio.Task] = None
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_depth: Dict[int, int] = defaultdict(int)
+        self._queued = 0
+        self._in_flight = 0
+        self._processed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        deferred: List["asyncio.Future[Any]"] = []
+        token = _deferred.set(deferred)
+        try:
+            with trace_update(update):
+                await self._process_in_chat_order(update, coroutine)
+                if deferred:
+                    with span("deferred_wait"):
+                        await _wait_deferred(deferred)
+        finally:
+            _deferred.reset(token)
+
+    async def _process_in_chat_order(
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        enqueued_at = time.monotonic()
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await self._process_with_slot(coroutine, enqueued_at)
+            return
+
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_depth[chat_id] += 1
+        try:
+            with span("chat_lock_wait"):
+                await lock.acquire()
+            try:
+                await self._process_with_slot(coroutine, enqueued_at)
+            finally:
+                lock.release()
+        finally:
+            self._chat_depth[chat_id] -= 1
+            if self._chat_depth[chat_id] == 0:
+                # nobody else waits for this chat => drop lock to keep dicts small
+                del self._chat_depth[chat_id]
+                del self._chat_locks[chat_id]
+
+    async def _process_with_slot(
+        self, coroutine: Awaitable[Any], enqueued_at: float
+    ) -> None:
+        self._queued += 1
+        try:
+            with span("slot_wait"):
+                await self._slots.acquire()
+        finally:
+            self._queued -= 1
+
+        wait = time.monotonic() - enqueued_at
+        self._processed += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+
+        self._in_flight += 1
+        try:
+            await coroutine
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    async def initialize(self) -> None:
+        if self._stats_log_interval > 0:
+            self._stats_task = asyncio.create_task(self._log_stats_periodically())
+
+    async def shutdown(self) -> None:
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            self._stats_task = None
+        self._log_stats()
+
+    async def _log_stats_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._stats_log_interval)
+            self._log_stats()
+
+    def _log_stats(self) -> None:
+        stats = self.stats()
+        logger.info(
+            "Updates: in_flight=%s queued=%s busiest_chat=%s processed=%s "
+            "avg_wait=%.3fs max_wait=%.3fs",
+            stats.in_flight,
+            stats.queued,
+            stats.busiest_chat_depth,
+            stats.processed,
+            stats.avg_wait_seconds,
+            stats.max_wait_seconds,
+        )
+
+    def stats(self) -> UpdateProcessorStats:
+        """
+        Snapshot of queue depth and wait time (enqueue -> handler start)
+        """
+        waiting_for_chat = sum(self._chat_depth.values()) - len(self._chat_depth)
+        return UpdateProcessorStats(
+            in_flight=self._in_flight,
+            queued=self._queued + max(waiting_for_chat, 0),
+            busiest_chat_depth=max(self._chat_depth.values(), default=0),
+            processed=self._processed,
+            avg_wait_seconds=(
+                self._wait_total / self._processed if self._processed else 0.0
+            ),
+            max_wait_seconds=self._wait_max,
+        )
@@ -0,0 +1,280 @@
+# pylint: disable=too-many-instance-attributes
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Any, Dict, Optional, Sequence, Set
+
+from redis.exceptions import ResponseError
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+from app.config import logger, settings
+from app.services.redis_client import redis_client
+
+STREAM_PREFIX = "updates"
+GROUP = "workers"
+WORKERS_KEY = f"{STREAM_PREFIX}:workers"
+
+# take the lease or prolong it if it is already ours
+ACQUIRE_LEASE_LUA = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_acquire_lease = redis_client.register_script(ACQUIRE_LEASE_LUA)
+_release_lease = redis_client.register_script(RELEASE_LEASE_LUA)
+
+
+def stream_key(shard: int) -> str:
+    return f"{STREAM_PREFIX}:{shard}"
+
+
+def _lease_key(shard: int) -> str:
+    return f"{STREAM_PREFIX}:{shard}:lease"
+
+
+def shard_for(update: Update, shards: int) -> int:
+    """
+    All updates of one chat go to the same shard, so they stay ordered
+    """
+    if update.effective_chat is not None:
+        owner_id = update.effective_chat.id
+    elif update.effective_user is not None:
+        owner_id = update.effective_user.id
+    else:
+        owner_id = 0
+    return owner_id % shards
+
+
+class UpdateStreamPublisher:
+    """
+    Ingress side: forwards raw updates to Redis Streams instead of handling them
+    """
+
+    def __init__(self) -> None:
+        self._shards = settings.update_stream_shards
+
+    async def forward(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Handler callback for the ingress application
+        """
+        await self.publish(update)
+
+    async def publish(self, update: Update) -> None:
+        await redis_client.xadd(
+            stream_key(shard_for(update, self._shards)),
+            {"update": json.dumps(update.to_dict())},
+            maxlen=settings.update_stream_maxlen,
+            approximate=True,
+        )
+
+
+class UpdateStreamWorker:
+    """
+    Worker side: consumes update streams through a consumer group
+
+    Every shard is owned by one worker at a time (lease key in Redis), so
+    per-chat order is kept across processes. Inside a shard every entry runs
+    as its own task (at most UPDATE_STREAM_BATCH at once) and is acked when
+    it is done: a slow GPT turn holds only its chat, ordering is left to the
+    per-chat lock of the update processor. Shards are balanced between
+    live workers; entries left unacked by a dead worker are reclaimed by
+    the next owner before it reads new ones
+    """
+
+    def __init__(self, application: Application) -> None:
+        self._application = application
+        self._shards = settings.update_stream_shards
+        self._worker_id = settings.worker_id
+        self._lease_ms = int(settings.update_stream_lease_seconds * 1000)
+        self._batch = settings.update_stream_batch
+        self._owned: Dict[int, asyncio.Task] = {}
+        self._releasing: set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        for shard in range(self._shards):
+            try:
+                await redis_client.xgroup_create(
+                    stream_key(shard), GROUP, id="0", mkstream=True
+                )
+            except ResponseError as exc:
+                if "BUSYGROUP" not in str(exc):
+                    raise
+        self._task = asyncio.create_task(self._balance_periodically())
+        logger.info(
+            "Update stream worker %s started (%s shards)",
+            self._worker_id,
+            self._shards,
+        )
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # finish current batches, then give the shards back
+        self._releasing.update(self._owned)
+        await asyncio.gather(*self._owned.values(), return_exceptions=True)
+        await redis_client.zrem(WORKERS_KEY, self._worker_id)
+
+    async def _balance_periodically(self) -> None:
+        while True:
+            try:
+                await self._balance()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                logger.exception("Update stream rebalance failed: %s", exc)
+            await asyncio.sleep(self._lease_ms / 3000)
+
+    async def _live_workers(self) -> int:
+        now_ms = int(time.time() * 1000)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(WORKERS_KEY, {self._worker_id: now_ms})
+            pipe.zremrangebyscore(WORKERS_KEY, 0, now_ms - self._lease_ms)
+            pipe.zcard(WORKERS_KEY)
+            results = await pipe.execute()
+        return max(int(results[-1]), 1)
+
+    async def _balance(self) -> None:
+        share = math.ceil(self._shards / await self._live_workers())
+
+        for shard in list(self._owned):
+            if shard in self._releasing:
+                continue
+            if not await _acquire_lease(
+                keys=[_lease_key(shard)], args=[self._worker_id, self._lease_ms]
+            ):
+                logger.warning("Lost lease on update shard %s", shard)
+                self._owned.pop(shard).cancel()
+
+        active = [shard for shard in self._owned if shard not in self._releasing]
+        for shard in active[share:]:
+            # surplus goes back to the pool for a newly started worker
+            self._releasing.add(shard)
+
+        free = [shard for shard in range(self._shards) if shard not in self._owned]
+        random.shuffle(free)
+        for shard in free:
+            if len(active) >= share:
+                break
+            if await _acquire_lease(
+                keys=[_lease_key(shard)], args=[self._worker_id, self._lease_ms]
+            ):
+                active.append(shard)
+                self._owned[shard] = asyncio.create_task(self._consume(shard))
+                logger.info("Worker %s took update shard %s", self._worker_id, shard)
+
+    async def _consume(self, shard: int) -> None:
+        stream = stream_key(shard)
+        in_flight: Set[asyncio.Task] = set()
+        released = False
+        try:
+            await self._reclaim(stream, in_flight)
+            while shard not in self._releasing:
+                await self._wait_for_room(in_flight)
+                response = await redis_client.xreadgroup(
+                    GROUP,
+                    self._worker_id,
+                    {stream: ">"},
+                    count=self._batch - len(in_flight),
+                    block=1000,
+                )
+                for _, entries in response or []:
+                    await self._dispatch(stream, entries, in_flight)
+            # released shard => finish what was read, then give it back
+            released = True
+            await asyncio.gather(*in_flight)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            # unacked entries stay pending and are reclaimed by the next owner
+            logger.exception("Update shard %s consumer failed: %s", shard, exc)
+        finally:
+            if not released:
+                # lease lost or failed => the next owner handles these again
+                for task in in_flight:
+                    task.cancel()
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            self._owned.pop(shard, None)
+            self._releasing.discard(shard)
+            await _release_lease(keys=[_lease_key(shard)], args=[self._worker_id])
+
+    async def _wait_for_room(self, in_flight: Set[asyncio.Task]) -> None:
+        while len(in_flight) >= self._batch:
+            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
+    async def _reclaim(self, stream: str, in_flight: Set[asyncio.Task]) -> None:
+        """
+        Take over entries that the previous owner read but never acked
+        """
+        start = "0-0"
+        while True:
+            next_start, entries, *_ = await redis_client.xautoclaim(
+                stream,
+                GROUP,
+                self._worker_id,
+                min_idle_time=0,  # the lease already says the old owner is gone
+                start_id=start,
+                count=self._batch,
+            )
+            if entries:
+                logger.info("Reclaimed %s pending updates on %s", len(entries), stream)
+                await self._dispatch(stream, entries, in_flight)
+            if next_start in ("0-0", b"0-0"):
+                return
+            start = next_start
+
+    async def _dispatch(
+        self,
+        stream: str,
+        entries: Sequence[tuple[str, Dict[str, Any]]],
+        in_flight: Set[asyncio.Task],
+    ) -> None:
+        """
+        Start entries in stream order: tasks of one chat queue up
+        on its lock in the same order
+        """
+        for entry_id, fields in entries:
+            await self._wait_for_room(in_flight)
+            task = asyncio.create_task(self._process_entry(stream, entry_id, fields))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+    async def _process_entry(
+        self, stream: str, entry_id: str, fields: Dict[str, Any]
+    ) -> None:
+        try:
+            update = Update.de_json(json.loads(fields["update"]), self._application.bot)
+        except (KeyError, ValueError):
+            logger.warning("Dropping malformed update %s on %s", entry_id, stream)
+            update = None
+
+        processor = self._application.update_processor
+        try:
+            if update is not None:
+                await processor.process_update(
+                    update, self._application.process_update(update)
+                )
+            await redis_client.xack(stream, GROUP, entry_id)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            # stays pending, the next owner of the shard retries it
+            logger.exception("Update %s on %s failed: %s", entry_id, stream, exc)
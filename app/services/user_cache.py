@@ -1,45 +1,116 @@
-from typing import Dict
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
 
 from telegram import Update
 
+from app.config import settings
+from app.metrics import USER_CACHE_EVICTIONS, USER_CACHE_LOOKUPS, USER_CACHE_SIZE
 from app.models.telegram_user import TelegramUserData
+from app.services.user_writer import UserWriteBehind
+from app.tracing import span
+
+
+@dataclass
+class UserCacheStats:
+    hits: int = 0
+    misses: int = 0
+    lru_evictions: int = 0
+    ttl_evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
 
 
 class UserCache:
     """
-    In-memory cache for Telegram users during bot runtime
+    Bounded in-memory cache for Telegram users during bot runtime
+
+    LRU with at most USER_CACHE_MAX_SIZE users; users idle for longer than
+    USER_CACHE_TTL_SECONDS are dropped. A miss is cheap: profile comes with
+    every update and role/DB state is resolved by RoleCache -> Postgres
     """
 
-    def __init__(self) -> None:
-        self._by_id: Dict[int, TelegramUserData] = {}
+    def __init__(self, writer: Optional[UserWriteBehind] = None) -> None:
+        self._max_size = settings.user_cache_max_size
+        self._ttl_seconds = settings.user_cache_ttl_seconds
+        # tg_id -> (user, expires_at), least recently used first
+        self._lru: OrderedDict[int, tuple[TelegramUserData, float]] = OrderedDict()
+        self._writer = writer
+        self.stats = UserCacheStats()
+        USER_CACHE_SIZE.set_function(self.__len__)
+
+    def __len__(self) -> int:
+        return len(self._lru)
 
     def get_or_create(self, update: Update) -> TelegramUserData:
         """
         Get user from memory cache or create if not presented
+        Every call is reported to write-behind writer (last_seen_at / profile)
         """
+        with span("user_cache.get_or_create"):
+            return self._get_or_create(update)
+
+    def _get_or_create(self, update: Update) -> TelegramUserData:
         tg_user = update.effective_user
         tg_id = tg_user.id
+        now = time.monotonic()
+        expires_at = now + self._ttl_seconds if self._ttl_seconds > 0 else float("inf")
 
-        cached_user = self._by_id.get(tg_id)
-        # if user already presented in telegram_users_by_tg_id => update data and return
-        if cached_user:
+        cached = self._lru.get(tg_id)
+        # if user already presented in cache => update data and return
+        if cached is not None and cached[1] > now:
+            cached_user = cached[0]
+            self.stats.hits += 1
+            USER_CACHE_LOOKUPS.labels(result="hit").inc()
             cached_user.username = tg_user.username or f"user_{tg_id}"
             cached_user.first_name = tg_user.first_name
             cached_user.last_name = tg_user.last_name
+            # sliding TTL: LRU order == expiry order
+            self._lru[tg_id] = (cached_user, expires_at)
+            self._lru.move_to_end(tg_id)
+            self._record_seen(cached_user)
             return cached_user
 
-        # if user is not presented in telegram_users_by_tg_id => create new record
+        # if user is not presented (or expired) => create new record
+        self.stats.misses += 1
+        USER_CACHE_LOOKUPS.labels(result="miss").inc()
         new_user = TelegramUserData(
             tg_id=tg_id,
             username=tg_user.username or f"user_{tg_id}",
             first_name=tg_user.first_name,
             last_name=tg_user.last_name,
         )
-        self._by_id[tg_id] = new_user
+        self._lru.pop(tg_id, None)
+        self._lru[tg_id] = (new_user, expires_at)
+        self._evict(now)
+        self._record_seen(new_user)
         return new_user
 
+    def _evict(self, now: float) -> None:
+        # expired users are always at the LRU end of the dict
+        while self._lru:
+            _, (_, oldest_expires_at) = next(iter(self._lru.items()))
+            if oldest_expires_at > now:
+                break
+            self._lru.popitem(last=False)
+            self.stats.ttl_evictions += 1
+            USER_CACHE_EVICTIONS.labels(reason="ttl").inc()
+
+        while len(self._lru) > self._max_size > 0:
+            self._lru.popitem(last=False)
+            self.stats.lru_evictions += 1
+            USER_CACHE_EVICTIONS.labels(reason="lru").inc()
+
+    def _record_seen(self, user: TelegramUserData) -> None:
+        if self._writer is not None:
+            self._writer.record(user)
+
     def clear(self) -> None:
         """
         Completely clear user cache
         """
-        self._by_id.clear()
+        self._lru.clear()
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from dataclasses import replace
+from typing import Dict, Optional
+
+from app.config import logger
+from app.db import UserRepo
+from app.metrics import USER_WRITE_BEHIND_PENDING
+from app.models.telegram_user import TelegramUserData
+
+
+class UserWriteBehind:
+    """
+    Write-behind buffer for last_seen_at and profile fields of bot.users
+
+    Every seen user is kept in memory (latest state per tg_id wins) and
+    the whole buffer is flushed as one multi-row upsert every interval
+    """
+
+    def __init__(self, user_repo: UserRepo, interval_seconds: float) -> None:
+        self._user_repo = user_repo
+        self._interval = interval_seconds
+        self._pending: Dict[int, tuple[TelegramUserData, float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        USER_WRITE_BEHIND_PENDING.set_function(lambda: self.pending_count)
+
+    def record(self, user: TelegramUserData) -> None:
+        """
+        Remember that user was seen now. Repeated calls for one tg_id are coalesced
+        """
+        # snapshot: UserCache mutates its objects in place
+        self._pending[user.tg_id] = (replace(user), time.time())
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """
+        Stop background flushing and save everything that is still pending
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, {}
+        try:
+            await self._user_repo.upsert_seen_users(list(batch.values()))
+        except Exception:
+            # put rows back unless a newer state arrived meanwhile
+            for tg_id, row in batch.items():
+                self._pending.setdefault(tg_id, row)
+            raise
+        logger.debug("Flushed %s seen users to bot.users", len(batch))
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.flush()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to flush seen users: %s", exc)
@@ -0,0 +1,103 @@
+import hmac
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from app.config import logger, settings
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Embedded aiohttp server that receives updates pushed by Telegram
+
+    POST <WEBHOOK_PATH> - update JSON, checked against WEBHOOK_SECRET
+    GET  /healthz       - liveness/readiness probe
+    Updates are put to application.update_queue, exactly like polling does.
+    At most WEBHOOK_MAX_CONNECTIONS requests are handled at once, from
+    arrival until the update is handed off, the rest get 503
+    """
+
+    def __init__(self, application: Application) -> None:
+        self._application = application
+        self._runner: Optional[web.AppRunner] = None
+        self._in_flight = 0
+
+        self.web_app = web.Application()
+        self.web_app.router.add_post(settings.webhook_path, self._handle_update)
+        self.web_app.router.add_get("/healthz", self._health)
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(
+            self._runner, host=settings.webhook_listen, port=settings.webhook_port
+        )
+        await site.start()
+        if not settings.webhook_secret:
+            logger.warning(
+                "WEBHOOK_SECRET is empty: webhook requests are not authenticated"
+            )
+        logger.info(
+            "Webhook server listening on %s:%s%s",
+            settings.webhook_listen,
+            settings.webhook_port,
+            settings.webhook_path,
+        )
+        if settings.webhook_url:
+            # without public URL server is still usable for local testing
+            await self._application.bot.set_webhook(
+                url=settings.webhook_url.rstrip("/") + settings.webhook_path,
+                secret_token=settings.webhook_secret or None,
+                max_connections=settings.webhook_max_connections,
+                allowed_updates=Update.ALL_TYPES,
+            )
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if self._in_flight >= settings.webhook_max_connections:
+            # Telegram redelivers the update later
+            return web.Response(status=503)
+
+        self._in_flight += 1
+        try:
+            return await self._receive(request)
+        finally:
+            self._in_flight -= 1
+
+    async def _receive(self, request: web.Request) -> web.Response:
+        secret = settings.webhook_secret
+        if secret and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), secret
+        ):
+            logger.warning("Webhook request with wrong secret from %s", request.remote)
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            if not isinstance(data, dict):
+                return web.Response(status=400)
+            update = Update.de_json(data, self._application.bot)
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+
+        if update is None:
+            return web.Response(status=400)
+        await self._application.update_queue.put(update)
+        return web.Response(status=200)
+
+    async def _health(self, _: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "status": "ok" if self._application.running else "starting",
+                "pending_updates": self._application.update_queue.qsize(),
+            },
+            status=200 if self._application.running else 503,
+        )
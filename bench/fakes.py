@@ -0,0 +1,239 @@
+"""
+Local stand-ins for external services used by the benchmarks
+"""
+
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+from itertools import count
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from aiohttp import web
+from telegram.request import BaseRequest, RequestData
+
+from app.models.telegram_user import TelegramUserData
+
+
+@dataclass(frozen=True)
+class OpenAIProfile:
+    ttft: float = 0.3  # seconds before the first token
+    token_delay: float = 0.01  # seconds between streamed tokens
+    answer_tokens: int = 80
+    straggler_rate: float = 0.0  # share of requests with straggler_ttft
+    straggler_ttft: float = 5.0
+
+
+class FakeOpenAIServer:
+    """
+    OpenAI-compatible /v1/chat/completions with configurable latency
+    Streams SSE chunks (with usage in the last one) when stream=true
+    """
+
+    def __init__(self, profile: OpenAIProfile, port: int = 0) -> None:
+        self.profile = profile
+        self.port = port
+        self.requests = 0
+        self._runner: Optional[web.AppRunner] = None
+
+        self.web_app = web.Application()
+        self.web_app.router.add_post("/v1/chat/completions", self._completions)
+        self.web_app.router.add_get("/v1/models/{model}", self._model)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        if self.port == 0:
+            server = site._server  # pylint: disable=protected-access
+            self.port = server.sockets[0].getsockname()[1]  # type: ignore
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _words(self) -> list[str]:
+        return [f"word{i} " for i in range(self.profile.answer_tokens)]
+
+    async def _model(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.profile.ttft)
+        return web.json_response(
+            {
+                "id": request.match_info["model"],
+                "object": "model",
+                "created": 0,
+                "owned_by": "bench",
+            }
+        )
+
+    async def _completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.json()
+        prompt_tokens = sum(len(m["content"]) // 4 + 4 for m in body["messages"])
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.profile.answer_tokens,
+            "total_tokens": prompt_tokens + self.profile.answer_tokens,
+        }
+        straggler = random.random() < self.profile.straggler_rate
+        await asyncio.sleep(
+            self.profile.straggler_ttft if straggler else self.profile.ttft
+        )
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.profile.token_delay * self.profile.answer_tokens)
+            return web.json_response(
+                {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": "".join(self._words()),
+                            },
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        try:
+            await response.prepare(request)
+            chunk: Dict[str, Any] = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body["model"],
+            }
+            for word in self._words():
+                delta = {"index": 0, "delta": {"content": word}, "finish_reason": None}
+                payload = {**chunk, "choices": [delta]}
+                await response.write(f"data: {json.dumps(payload)}\n\n".encode())
+                await asyncio.sleep(self.profile.token_delay)
+            if body.get("stream_options", {}).get("include_usage"):
+                payload = {**chunk, "choices": [], "usage": usage}
+                await response.write(f"data: {json.dumps(payload)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # client gave up (e.g. a cancelled hedged request)
+            pass
+        return response
+
+
+class FakeUserRepo:
+    """
+    In-memory UserRepo with the same async interface and optional latency
+    """
+
+    def __init__(self, role: str = "user", latency: float = 0.002) -> None:
+        self._role = role
+        self._latency = latency
+        self._roles: Dict[int, str] = {}
+        self._role_listeners: list[Any] = []
+        self.queries = 0
+
+    async def _query(self) -> None:
+        self.queries += 1
+        await asyncio.sleep(self._latency)
+
+    def add_role_listener(self, listener: Any) -> None:
+        self._role_listeners.append(listener)
+
+    async def connect(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+    def pool_stats(self) -> dict[str, int]:
+        return {"queries": self.queries}
+
+    async def upsert_and_get_role(
+        self, user: TelegramUserData, default_role: str = "guest"
+    ) -> str:
+        await self._query()
+        return self._roles.setdefault(user.tg_id, self._role or default_role)
+
+    async def upsert_seen_users(
+        self,
+        users: Sequence[tuple[TelegramUserData, float]],
+        default_role: str = "guest",
+    ) -> None:
+        await self._query()
+        for user, _ in users:
+            self._roles.setdefault(user.tg_id, self._role or default_role)
+
+    async def set_role(self, tg_id: int, role: str) -> None:
+        await self._query()
+        self._roles[tg_id] = role
+        for listener in self._role_listeners:
+            await listener(tg_id)
+
+    async def get_role(self, tg_id: int) -> Optional[str]:
+        await self._query()
+        return self._roles.get(tg_id)
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    Bot API transport that answers locally instead of calling Telegram
+    """
+
+    def __init__(self, latency: float = 0.05) -> None:
+        self._latency = latency
+        self._message_ids = count(1_000_000)
+        self.calls: Dict[str, int] = {}
+
+    async def initialize(self) -> None:
+        return None
+
+    async def shutdown(self) -> None:
+        return None
+
+    async def do_request(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout: Any = None,
+        write_timeout: Any = None,
+        connect_timeout: Any = None,
+        pool_timeout: Any = None,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+        await asyncio.sleep(self._latency)
+
+        result: Any
+        if api_method == "getMe":
+            result = {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "bench",
+                "username": "bench_bot",
+            }
+        elif api_method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            result = {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
@@ -0,0 +1,140 @@
+"""
+Chat history entry formats: size, encode/decode cost and Redis memory
+
+Compares the old JSON entries with the binary format (with and without
+zlib) on a synthetic dialog. With --redis-url every variant is also
+pushed to a list and measured with MEMORY USAGE.
+
+    python -m bench.history_encoding --entries 20000 --redis-url redis://localhost
+"""
+
+# pylint: disable=import-outside-toplevel, too-many-locals
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import replace
+from typing import Callable, Dict, List, Tuple
+
+WORDS = (
+    "привет как настроить nginx reverse proxy для докер контейнера "
+    "сервис падает после деплоя kubernetes pod restart логи показывают "
+    "connection refused to postgres база данных индекс запрос медленный "
+    "explain analyze помогает увидеть план выполнения"
+).split()
+CODE = "server {\n    listen 80;\n    location / { proxy_pass http://app:8000; }\n}\n"
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--redis-url", default="", help="measure MEMORY USAGE")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def _dialog(entries: int, seed: int) -> List[Tuple[str, str]]:
+    rnd = random.Random(seed)
+    dialog = []
+    for i in range(entries):
+        if i % 2 == 0:
+            text = " ".join(rnd.choices(WORDS, k=rnd.randint(5, 40)))
+            dialog.append(("user", text))
+        else:
+            text = " ".join(rnd.choices(WORDS, k=rnd.randint(60, 400)))
+            if rnd.random() < 0.3:
+                text += f"\n```nginx\n{CODE * rnd.randint(1, 5)}```"
+            dialog.append(("assistant", text))
+    return dialog
+
+
+def _measure(
+    dialog: List[Tuple[str, str]],
+    encode: Callable[[str, str], bytes],
+    decode: Callable[[bytes], Dict],
+) -> Tuple[List[bytes], float, float]:
+    started = time.perf_counter()
+    encoded = [encode(role, content) for role, content in dialog]
+    encode_us = (time.perf_counter() - started) / len(dialog) * 1e6
+
+    started = time.perf_counter()
+    for item in encoded:
+        decode(item)
+    decode_us = (time.perf_counter() - started) / len(dialog) * 1e6
+    return encoded, encode_us, decode_us
+
+
+async def _redis_memory(redis_url: str, key: str, encoded: List[bytes]) -> int:
+    import redis.asyncio as redis
+
+    client = redis.Redis.from_url(redis_url)
+    try:
+        await client.delete(key)
+        for start in range(0, len(encoded), 1000):
+            await client.rpush(key, *encoded[start : start + 1000])
+        usage = await client.memory_usage(key, samples=0)
+        await client.delete(key)
+        return int(usage or 0)
+    finally:
+        await client.aclose()
+
+
+def main() -> None:
+    args = _parse_args()
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:bench")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+    from app.config import settings
+    from app.services import history_service
+    from app.services.tokens import estimate_message_tokens
+
+    def encode_json(role: str, content: str) -> bytes:
+        # format used before binary entries
+        entry = {
+            "role": role,
+            "content": content,
+            "tokens": estimate_message_tokens(content),
+        }
+        return json.dumps(entry).encode()
+
+    def encode_binary(role: str, content: str) -> bytes:
+        # pylint: disable=protected-access
+        return history_service._encode(role, content, estimate_message_tokens(content))
+
+    # pylint: disable=protected-access
+    decode = history_service._decode
+    threshold = settings.chat_history_compress_threshold or 512
+    variants = {
+        "json (old)": (encode_json, 0),
+        "binary": (encode_binary, 0),
+        f"binary+zlib>{threshold}B": (encode_binary, threshold),
+    }
+
+    dialog = _dialog(args.entries, args.seed)
+    print(f"{args.entries} entries\n")
+    header = f"{'format':<22}{'bytes/entry':>12}{'encode us':>11}{'decode us':>11}"
+    print(header + ("  redis MEMORY USAGE" if args.redis_url else ""))
+    for name, (encode, compress_threshold) in variants.items():
+        history_service.settings = replace(
+            settings,
+            chat_history_format="binary",
+            chat_history_compress_threshold=compress_threshold,
+        )
+        encoded, encode_us, decode_us = _measure(dialog, encode, decode)
+        line = (
+            f"{name:<22}{sum(map(len, encoded)) / len(encoded):>12.0f}"
+            f"{encode_us:>11.1f}{decode_us:>11.1f}"
+        )
+        if args.redis_url:
+            usage = asyncio.run(
+                _redis_memory(args.redis_url, "bench:history_encoding", encoded)
+            )
+            line += f"  {usage / 2**20:.1f} MB"
+        print(line)
+    history_service.settings = settings
+
+
+if __name__ == "__main__":
+    main()
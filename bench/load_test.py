@@ -0,0 +1,211 @@
+"""
+Offline load test: N simulated users talk to the real handlers
+
+OpenAI, Telegram Bot API and Postgres are replaced by local fakes
+(bench/fakes.py), Redis is in-process (fakeredis) unless --redis-url
+is given. Every update is traced, so the report shows per-stage latency.
+
+    python -m bench.load_test --users 200 --messages 5 --stream
+
+Tail latency from OpenAI stragglers with and without hedging:
+
+    python -m bench.load_test --openai-stragglers 0.03 --openai-straggler-ttft 5
+    OPENAI_HEDGE=true python -m bench.load_test \
+        --openai-stragglers 0.03 --openai-straggler-ttft 5
+"""
+
+# pylint: disable=import-outside-toplevel
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from bench.fakes import FakeOpenAIServer, FakeTelegramRequest, OpenAIProfile
+
+FIRST_USER_ID = 100_000
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=5, help="per user")
+    parser.add_argument(
+        "--think", type=float, default=0.0, help="seconds between user messages"
+    )
+    parser.add_argument("--stream", action="store_true", help="GPT_STREAM=true")
+    parser.add_argument("--openai-ttft", type=float, default=0.3)
+    parser.add_argument("--openai-token-delay", type=float, default=0.01)
+    parser.add_argument("--answer-tokens", type=int, default=80)
+    parser.add_argument(
+        "--openai-stragglers",
+        type=float,
+        default=0.0,
+        help="share of OpenAI requests answered after --openai-straggler-ttft",
+    )
+    parser.add_argument("--openai-straggler-ttft", type=float, default=5.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--redis-url", default="", help="real Redis instead of fake")
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="track Python heap (slower)"
+    )
+    parser.add_argument("--verbose", action="store_true", help="keep ezBot INFO logs")
+    return parser.parse_args()
+
+
+def _configure_env(args: argparse.Namespace, openai_url: str) -> None:
+    """
+    Settings are read at import time => must run before importing app
+    """
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:bench")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    os.environ.setdefault("ADMIN_USER_ID", "1")
+    os.environ["OPENAI_BASE_URL"] = openai_url
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["TRACE_SAMPLE_RATE"] = "1"
+    os.environ["TRACE_EXPORTER"] = "none"
+    os.environ["GPT_STREAM"] = "true" if args.stream else "false"
+    # measure the bot, not the production rate limits (override via env)
+    os.environ.setdefault("OPENAI_RPM", "0")
+    os.environ.setdefault("OPENAI_TPM", "0")
+    os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "100000")
+    os.environ.setdefault("TELEGRAM_CHAT_RATE", "100000")
+    os.environ.setdefault("TELEGRAM_CHAT_BURST", "100000")
+
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+        return
+
+    import fakeredis
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+    redis.asyncio.Redis.from_url = (  # type: ignore[method-assign]
+        lambda url, **kwargs: fakeredis.aioredis.FakeRedis(server=server, **kwargs)
+    )
+
+
+def _message_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _report(
+    stages: Dict[str, List[float]], updates: int, elapsed: float, extra: Dict[str, Any]
+) -> None:
+    print(f"\nupdates: {updates} in {elapsed:.2f}s => {updates / elapsed:.1f} upd/s")
+    print(f"{'stage':<34}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, values in sorted(stages.items()):
+        print(
+            f"{name:<34}{len(values):>8}"
+            f"{_percentile(values, 50):>10.1f}"
+            f"{_percentile(values, 95):>10.1f}"
+            f"{_percentile(values, 99):>10.1f}"
+        )
+    for key, value in extra.items():
+        print(f"{key}: {value}")
+
+
+async def run(args: argparse.Namespace) -> None:  # pylint: disable=too-many-locals
+    openai_server = FakeOpenAIServer(
+        OpenAIProfile(
+            ttft=args.openai_ttft,
+            token_delay=args.openai_token_delay,
+            answer_tokens=args.answer_tokens,
+            straggler_rate=args.openai_stragglers,
+            straggler_ttft=args.openai_straggler_ttft,
+        )
+    )
+    await openai_server.start()
+    _configure_env(args, openai_server.base_url)
+
+    from telegram import Update
+
+    from app.config import logger
+    from app.tracing import Trace, add_trace_listener
+    from bench.fakes import FakeUserRepo
+    from bot import build_telegram_app
+
+    stages: Dict[str, List[float]] = defaultdict(list)
+    done: Dict[int, asyncio.Future] = {}
+
+    def on_trace(trace: Trace) -> None:
+        for span in trace.spans:
+            stages[span.name].append(span.duration_ms)
+        future = done.pop(trace.update_id or 0, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    add_trace_listener(on_trace)
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+
+    user_repo = FakeUserRepo(latency=args.db_latency)
+    telegram_request = FakeTelegramRequest(latency=args.telegram_latency)
+    telegram_app = build_telegram_app(
+        user_repo, request=telegram_request  # type: ignore[arg-type]
+    )
+    await telegram_app.start()
+    bot = telegram_app.app.bot
+    loop = asyncio.get_running_loop()
+
+    async def simulate_user(index: int) -> None:
+        user_id = FIRST_USER_ID + index
+        for n in range(args.messages):
+            update_id = index * args.messages + n + 1
+            answered = done[update_id] = loop.create_future()
+            update = Update.de_json(
+                _message_update(update_id, user_id, f"question {n} from {user_id}"),
+                bot,
+            )
+            await telegram_app.app.update_queue.put(update)
+            await answered
+            if args.think:
+                await asyncio.sleep(args.think)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    extra: Dict[str, Any] = {
+        "openai requests": openai_server.requests,
+        "telegram calls": dict(sorted(telegram_request.calls.items())),
+        "db queries": user_repo.queries,
+        "max rss MB": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+    }
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        extra["python heap MB (current/peak)"] = (
+            f"{current / 2**20:.1f}/{peak / 2**20:.1f}"
+        )
+        tracemalloc.stop()
+
+    await telegram_app.stop()
+    await openai_server.stop()
+    _report(stages, args.users * args.messages, elapsed, extra)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(_parse_args()))
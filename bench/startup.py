@@ -0,0 +1,212 @@
+"""
+Cold start: import time, DB bootstrap and time until the bot is ready
+
+1. `import bot` in fresh interpreters (median of --runs)
+2. init_db(): full bootstrap vs schema_version fast path (needs Postgres,
+   POSTGRES_DSN or --postgres-dsn; skipped if it is unreachable)
+3. TelegramApp.start() with local fakes: getMe and the readiness checks
+   (Postgres bootstrap, Redis, OpenAI) run concurrently, compared with
+   the sum of the same steps run one after another
+
+    python -m bench.startup --runs 5 --postgres-dsn postgresql://postgres@localhost/bot
+"""
+
+# pylint: disable=import-outside-toplevel, too-many-locals
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import replace
+from typing import Callable, Dict, Optional
+
+from bench.fakes import FakeOpenAIServer, FakeTelegramRequest, OpenAIProfile
+
+IMPORT_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+import bot
+print(json.dumps({
+    "seconds": time.perf_counter() - started,
+    "openai": "openai" in sys.modules,
+    "aiohttp": "aiohttp" in sys.modules,
+}))
+"""
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--postgres-dsn", default="", help="default: POSTGRES_DSN")
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--telegram-latency", type=float, default=0.1)
+    parser.add_argument(
+        "--db-bootstrap",
+        type=float,
+        default=0.0,
+        help="simulated init_db seconds for step 3 (default: measured fast path)",
+    )
+    parser.add_argument("--ready", default="", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def _configure_env(args: argparse.Namespace) -> None:
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:bench")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    if args.postgres_dsn:
+        os.environ["POSTGRES_DSN"] = args.postgres_dsn
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["TRACE_EXPORTER"] = "none"
+
+
+def _median_ms(measure: Callable[[], float], runs: int) -> float:
+    return statistics.median(measure() for _ in range(runs)) * 1000
+
+
+def measure_import(runs: int) -> None:
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            check=True,
+            capture_output=True,
+            text=True,
+            env=os.environ,
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    median = statistics.median(result["seconds"] for result in results) * 1000
+    print(
+        f"{'import bot':<34}{median:>10.0f} ms"
+        f"   (openai loaded: {results[0]['openai']},"
+        f" aiohttp loaded: {results[0]['aiohttp']})"
+    )
+
+
+def measure_db_bootstrap(runs: int) -> Optional[float]:
+    import psycopg
+
+    from app.config import settings
+    from app.db import db_init
+
+    def timed(mode: str) -> float:
+        db_init.settings = replace(settings, db_bootstrap=mode)
+        started = time.perf_counter()
+        db_init.init_db()
+        return time.perf_counter() - started
+
+    try:
+        timed("always")  # make sure the schema is current
+    except psycopg.Error as exc:
+        print(f"{'init_db':<34}{'skipped':>10}   (no Postgres: {exc})")
+        return None
+
+    full = _median_ms(lambda: timed("always"), runs)
+    fast = _median_ms(lambda: timed("auto"), runs)
+    db_init.settings = settings
+    print(f"{'init_db (full bootstrap)':<34}{full:>10.1f} ms")
+    print(f"{'init_db (schema_version current)':<34}{fast:>10.1f} ms")
+    return fast / 1000
+
+
+async def _ready(args: argparse.Namespace, mode: str) -> Dict[str, float]:
+    """
+    One cold start in this (fresh) interpreter, mode "concurrent" or "serial"
+    """
+    openai_server = FakeOpenAIServer(OpenAIProfile(ttft=args.openai_latency))
+    await openai_server.start()
+    os.environ["OPENAI_BASE_URL"] = openai_server.base_url
+
+    import fakeredis
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+    redis.asyncio.Redis.from_url = (  # type: ignore[method-assign]
+        lambda url, **kwargs: fakeredis.aioredis.FakeRedis(server=server, **kwargs)
+    )
+
+    from app.services.gpt_service import check_openai
+    from app.services.readiness import check_redis
+    from bench.fakes import FakeUserRepo
+    from bot import build_telegram_app
+
+    def db_bootstrap() -> None:
+        time.sleep(args.db_bootstrap)
+
+    telegram_app = build_telegram_app(
+        FakeUserRepo(),  # type: ignore[arg-type]
+        request=FakeTelegramRequest(latency=args.telegram_latency),
+        db_bootstrap=db_bootstrap,
+    )
+    steps: Dict[str, float] = {}
+    started = time.perf_counter()
+    if mode == "concurrent":
+        await telegram_app.start()
+        steps["total"] = time.perf_counter() - started
+        await telegram_app.stop()
+    else:
+        serial_steps = {
+            "getMe": telegram_app.app.initialize,
+            "postgres": lambda: asyncio.to_thread(db_bootstrap),
+            "redis": check_redis,
+            "openai": check_openai,
+        }
+        for name, step in serial_steps.items():
+            step_started = time.perf_counter()
+            await step()
+            steps[name] = time.perf_counter() - step_started
+        steps["total"] = time.perf_counter() - started
+        await telegram_app.app.shutdown()
+    await openai_server.stop()
+    return steps
+
+
+def measure_ready(args: argparse.Namespace) -> None:
+    results = {}
+    for mode in ("serial", "concurrent"):
+        command = [
+            sys.executable,
+            "-m",
+            "bench.startup",
+            f"--ready={mode}",
+            f"--openai-latency={args.openai_latency}",
+            f"--telegram-latency={args.telegram_latency}",
+            f"--db-bootstrap={args.db_bootstrap}",
+        ]
+        output = subprocess.run(
+            command, check=True, capture_output=True, text=True, env=os.environ
+        ).stdout
+        results[mode] = json.loads(output.splitlines()[-1])
+
+    serial = results["serial"]
+    detail = ", ".join(
+        f"{name} {value * 1000:.0f}"
+        for name, value in serial.items()
+        if name != "total"
+    )
+    print(f"{'ready, steps one by one':<34}{serial['total'] * 1000:>10.0f} ms")
+    print(f"   ({detail} ms, openai includes its import)")
+    total = results["concurrent"]["total"] * 1000
+    print(f"{'ready, TelegramApp.start()':<34}{total:>10.0f} ms")
+
+
+def main() -> None:
+    args = _parse_args()
+    _configure_env(args)
+    if args.ready:
+        # child process of measure_ready()
+        logging.disable(logging.INFO)
+        print(json.dumps(asyncio.run(_ready(args, args.ready))))
+        return
+
+    measure_import(args.runs)
+    fast_path = measure_db_bootstrap(args.runs)
+    args.db_bootstrap = args.db_bootstrap or fast_path or 0.05
+    measure_ready(args)
+
+
+if __name__ == "__main__":
+    main()
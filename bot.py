@@ -1,16 +1,135 @@
-from app.db import UserRepo, init_db
-from app.services import TelegramApp, UserCache, ask_gpt
+import asyncio
+from typing import Callable, Optional
 
+from telegram.request import BaseRequest
 
-def main():
-    # database init
-    init_db()
+from app.config import settings
+from app.db import ChatArchiveRepo, UserRepo, init_db
+from app.metrics import start_metrics_server
+from app.services import (
+    ChatArchive,
+    MessageCoalescer,
+    ResponseCache,
+    RoleCache,
+    TelegramApp,
+    TelegramSender,
+    UpdateDedup,
+    UpdateStreamPublisher,
+    UserCache,
+    UserWriteBehind,
+    ask_gpt,
+    close_redis,
+    history_service,
+    stream_gpt,
+)
+from app.services.gpt_service import check_openai
+from app.services.readiness import check_redis, wait_ready
+from app.services.redis_client import redis_client
+from app.tracing import otlp_exporter
+
+
+def run_ingress():
+    # no handlers and no DB here: updates are only pushed to Redis Streams
+    telegram_app = TelegramApp().register_ingress(UpdateStreamPublisher())
+    telegram_app.on_startup(lambda: wait_ready({"redis": check_redis}))
+    telegram_app.on_startup(start_metrics_server)
+    telegram_app.on_startup(otlp_exporter.start)
+    telegram_app.on_shutdown(otlp_exporter.stop)
+    telegram_app.on_shutdown(close_redis)
+    telegram_app.run()
 
-    TelegramApp().with_dependencies(
-        user_repo=UserRepo(),
+
+def build_telegram_app(
+    user_repo: UserRepo,
+    request: Optional[BaseRequest] = None,
+    db_bootstrap: Optional[Callable[[], None]] = None,
+) -> TelegramApp:
+    """
+    Wire services and lifecycle hooks around user_repo (also used by bench/)
+    db_bootstrap (init_db) runs on startup, concurrently with the other checks
+    """
+    role_cache = RoleCache(
+        user_repo,
+        ttl_seconds=settings.role_cache_ttl_seconds,
+        max_size=settings.role_cache_max_size,
+        redis_client=redis_client if settings.role_cache_redis else None,
+        pubsub_client=redis_client,
+    )
+    response_cache = ResponseCache(
+        redis_client=redis_client if settings.response_cache_redis else None,
+    )
+    user_writer = (
+        UserWriteBehind(user_repo, settings.user_write_behind_interval)
+        if settings.user_write_behind_interval > 0
+        else None
+    )
+
+    telegram_app = TelegramApp(request=request).with_dependencies(
+        user_repo=user_repo,
+        role_cache=role_cache,
+        response_cache=response_cache,
         ask_gpt=ask_gpt,
-        user_cache=UserCache(),
-    ).register().run()
+        stream_gpt=stream_gpt,
+        user_cache=UserCache(writer=user_writer),
+        telegram_sender=TelegramSender(),
+    )
+    update_dedup = (
+        UpdateDedup(
+            redis_client,
+            ttl_seconds=settings.update_dedup_ttl_seconds,
+            lease_seconds=settings.update_dedup_lease_seconds,
+        )
+        if settings.update_dedup_ttl_seconds > 0
+        else None
+    )
+    if update_dedup is not None:
+        telegram_app.with_dependencies(update_dedup=update_dedup)
+    if settings.chat_debounce_seconds > 0:
+        telegram_app.with_dependencies(
+            message_coalescer=MessageCoalescer(settings.chat_debounce_seconds)
+        )
+    telegram_app.on_startup(start_metrics_server)
+    telegram_app.on_startup(otlp_exporter.start)
+    telegram_app.on_shutdown(otlp_exporter.stop)
+
+    async def connect_postgres() -> None:
+        if db_bootstrap is not None:
+            # sync psycopg => in a thread, so Redis/OpenAI checks overlap it
+            await asyncio.to_thread(db_bootstrap)
+        await user_repo.connect()
+
+    checks = {"postgres": connect_postgres, "redis": check_redis}
+    if settings.startup_check_openai:
+        checks["openai"] = check_openai
+    telegram_app.on_startup(lambda: wait_ready(checks, optional=("openai",)))
+    telegram_app.on_shutdown(user_repo.close)
+    if user_writer is not None:
+        telegram_app.on_startup(user_writer.start)
+        # registered after user_repo.close => runs before it
+        telegram_app.on_shutdown(user_writer.stop)
+    if settings.chat_archive:
+        chat_archive = ChatArchive(
+            ChatArchiveRepo(user_repo.pool), settings.chat_archive_interval
+        )
+        history_service.use_archive(chat_archive)
+        telegram_app.on_startup(chat_archive.start)
+        telegram_app.on_shutdown(chat_archive.stop)
+    telegram_app.on_shutdown(close_redis)
+    telegram_app.on_startup(role_cache.start)
+    # registered after close_redis => runs before it
+    telegram_app.on_shutdown(role_cache.stop)
+    if update_dedup is not None:
+        telegram_app.on_startup(update_dedup.start)
+        telegram_app.on_shutdown(update_dedup.stop)
+    return telegram_app.register()
+
+
+def main():
+    if settings.bot_role == "ingress":
+        run_ingress()
+        return
+
+    build_telegram_app(UserRepo(), db_bootstrap=init_db).run()
 
 
 if __name__ == "__main__":